@@ -0,0 +1,171 @@
+import os
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from app.db.async_connection import get_async_db
+from app.db.metric_registry import invalid_metrics
+from app.schemas.alert import AlertRuleCreate, AlertRuleUpdate
+from app.core.auth import get_current_user
+from app.core.ownership import ensure_device_in_org_async
+from app.core.alerts import engine
+
+
+router = APIRouter(prefix="/alert", tags=["Alert"])
+
+EVENTS_MAX_LIMIT = int(os.getenv("ALERT_EVENTS_MAX_LIMIT", "1000"))
+
+
+ORG_RULES_SQL = """
+	SELECT r.*
+	FROM alert_rule r
+	JOIN device_master d ON d.device_id=r.device_id
+	JOIN plant_master p ON d.plant_id=p.plant_id
+	JOIN site_master s ON p.site_id=s.site_id
+	WHERE s.org_id=%s
+"""
+
+# columns an update may not set to null; the others clear a bound or alpha
+NOT_NULL = ("metric", "kind", "min_samples", "cooldown_s", "enabled")
+
+
+def _validate(rule: dict):
+	invalid = invalid_metrics([rule["metric"]])
+	if invalid:
+		raise HTTPException(status_code=400, detail=f"Invalid metrics: {', '.join(invalid)}")
+	kind = rule["kind"]
+	if kind == "threshold" and rule.get("lower") is None and rule.get("upper") is None:
+		raise HTTPException(status_code=400, detail="threshold rules need lower and/or upper")
+	if kind == "rate" and not (rule.get("max_rate") or 0) > 0:
+		raise HTTPException(status_code=400, detail="rate rules need a positive max_rate")
+	if kind == "zscore":
+		if not (rule.get("z_limit") or 0) > 0:
+			raise HTTPException(status_code=400, detail="zscore rules need a positive z_limit")
+		if rule.get("alpha") is not None and not 0 < rule["alpha"] < 1:
+			raise HTTPException(status_code=400, detail="alpha must be between 0 and 1")
+	if rule.get("min_samples", 30) < 2 or rule.get("cooldown_s", 0) < 0:
+		raise HTTPException(status_code=400, detail="min_samples must be >= 2 and cooldown_s >= 0")
+
+
+async def _org_rule(cur, org_id: str, rule_id: int) -> dict:
+	await cur.execute(ORG_RULES_SQL + " AND r.rule_id=%s;", (org_id, rule_id))
+	row = await cur.fetchone()
+	if not row:
+		raise HTTPException(status_code=404, detail="Rule not found")
+	return row
+
+
+@router.post("/rules")
+async def create_rule(rule: AlertRuleCreate, current_user = Depends(get_current_user)):
+	data = rule.dict()
+	_validate(data)
+	async with get_async_db() as cur:
+		await ensure_device_in_org_async(cur, current_user["org_id"], rule.device_id)
+		cols = ', '.join(data.keys())
+		vals = ', '.join(['%s'] * len(data))
+		await cur.execute(
+			f"INSERT INTO alert_rule ({cols}) VALUES ({vals}) RETURNING *;",
+			tuple(data.values()),
+		)
+		row = await cur.fetchone()
+	engine.put_rule(row)
+	return row
+
+
+@router.get("/rules")
+async def list_rules(device_id: str | None = None, current_user = Depends(get_current_user)):
+	params: list = [current_user["org_id"]]
+	sql = ORG_RULES_SQL
+	if device_id is not None:
+		sql += " AND r.device_id=%s"
+		params.append(device_id)
+	async with get_async_db(readonly=True) as cur:
+		await cur.execute(sql + " ORDER BY r.rule_id;", tuple(params))
+		return await cur.fetchall()
+
+
+@router.get("/rules/{rule_id}")
+async def get_rule(rule_id: int, current_user = Depends(get_current_user)):
+	async with get_async_db(readonly=True) as cur:
+		return await _org_rule(cur, current_user["org_id"], rule_id)
+
+
+@router.put("/rules/{rule_id}")
+async def update_rule(rule_id: int, change: AlertRuleUpdate, current_user = Depends(get_current_user)):
+	# an explicit null clears the field; fields left out are kept
+	data = change.dict(exclude_unset=True)
+	if not data:
+		raise HTTPException(status_code=400, detail="No fields to update")
+	cleared = [k for k in NOT_NULL if k in data and data[k] is None]
+	if cleared:
+		raise HTTPException(status_code=400, detail=f"Cannot clear: {', '.join(cleared)}")
+	async with get_async_db() as cur:
+		current = await _org_rule(cur, current_user["org_id"], rule_id)
+		_validate({**current, **data})
+		set_clause = ', '.join([f"{k}=%s" for k in data.keys()])
+		await cur.execute(
+			f"UPDATE alert_rule SET {set_clause} WHERE rule_id=%s RETURNING *;",
+			tuple(list(data.values()) + [rule_id]),
+		)
+		row = await cur.fetchone()
+	engine.put_rule(row)
+	return row
+
+
+@router.delete("/rules/{rule_id}")
+async def delete_rule(rule_id: int, current_user = Depends(get_current_user)):
+	async with get_async_db() as cur:
+		await _org_rule(cur, current_user["org_id"], rule_id)
+		await cur.execute("DELETE FROM alert_rule WHERE rule_id=%s;", (rule_id,))
+	engine.drop_rule(rule_id)
+	return {"status": "deleted"}
+
+
+@router.get("/events")
+async def list_events(
+	response: Response,
+	device_id: str | None = None,
+	rule_id: int | None = None,
+	status: str | None = None,
+	start_ms: int | None = None,
+	end_ms: int | None = None,
+	limit: int = Query(default=100, ge=1, le=EVENTS_MAX_LIMIT),
+	cursor: int | None = None,
+	current_user = Depends(get_current_user),
+):
+	"""Fired and resolved events, newest first; page with the X-Next-Cursor header."""
+	where = ["s.org_id=%s"]
+	params: list = [current_user["org_id"]]
+	for column, value in (("e.device_id", device_id), ("e.rule_id", rule_id), ("e.status", status)):
+		if value is not None:
+			where.append(f"{column}=%s")
+			params.append(value)
+	if start_ms is not None:
+		where.append("e.ts >= to_timestamp(%s/1000.0)")
+		params.append(start_ms)
+	if end_ms is not None:
+		where.append("e.ts <= to_timestamp(%s/1000.0)")
+		params.append(end_ms)
+	if cursor is not None:
+		where.append("e.event_id < %s")
+		params.append(cursor)
+	async with get_async_db(readonly=True) as cur:
+		await cur.execute(
+			f"""
+			SELECT e.event_id, e.rule_id, e.device_id, e.metric, e.kind, e.status, e.ts, e.value, e.score
+			FROM alert_event e
+			JOIN device_master d ON d.device_id=e.device_id
+			JOIN plant_master p ON d.plant_id=p.plant_id
+			JOIN site_master s ON p.site_id=s.site_id
+			WHERE {" AND ".join(where)}
+			ORDER BY e.event_id DESC
+			LIMIT %s;
+			""",
+			tuple(params + [limit]),
+		)
+		rows = await cur.fetchall()
+	if len(rows) == limit and rows:
+		response.headers["X-Next-Cursor"] = str(rows[-1]["event_id"])
+	return rows
+
+
+@router.get("/stats")
+async def alert_stats(current_user = Depends(get_current_user)):
+	return engine.stats()
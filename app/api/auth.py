@@ -3,8 +3,10 @@ import os
 import jwt
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordRequestForm
-from passlib.hash import pbkdf2_sha256
-from app.db.connection import get_db
+from app.db.async_connection import get_async_db
+from app.core.auth import get_current_user, cache_stats
+from app.core import device_keys, passwords
+from app.core.passwords import verify_password
 
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -19,20 +21,24 @@ def _create_access_token(payload: dict, expires_delta: timedelta | None = None)
 
 
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 	# username/password form fields expected
-	with get_db() as cur:
-		cur.execute(
+	async with get_async_db() as cur:
+		await cur.execute(
 			"SELECT username, password, org_id, role FROM user_master WHERE username=%s;",
 			(form_data.username,),
 		)
-		user = cur.fetchone()
-		if not user or not pbkdf2_sha256.verify(form_data.password, user["password"]):
-			raise HTTPException(status_code=400, detail="Incorrect username or password")
+		user = await cur.fetchone()
+	# hashing runs in the password process pool, never on the event loop or request threads
+	if not user or not await verify_password(form_data.password, user["password"]):
+		raise HTTPException(status_code=400, detail="Incorrect username or password")
 
-		token = _create_access_token(
-			{"sub": user["username"], "org_id": user["org_id"], "role": user["role"]}
-		)
-		return {"access_token": token, "token_type": "bearer"}
+	token = _create_access_token(
+		{"sub": user["username"], "org_id": user["org_id"], "role": user["role"]}
+	)
+	return {"access_token": token, "token_type": "bearer"}
 
 
+@router.get("/cache")
+def auth_cache_stats(current_user = Depends(get_current_user)):
+	return {**cache_stats(), "device_keys": device_keys.stats(), "passwords": passwords.stats()}
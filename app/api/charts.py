@@ -1,84 +1,106 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
-from typing import List
-from app.db.connection import get_db
+import os
+from fastapi import APIRouter, HTTPException, Query, Depends, Header
+from datetime import datetime, timezone
+from typing import List, Literal
+from psycopg.rows import tuple_row
+from app.db.async_connection import get_async_db
 from app.core.auth import get_current_user
+from app.core.ownership import ensure_device_in_org_async, scope_devices_async
+from app.core.latest import store, as_metrics
+from app.core.downsample import parse_interval, lttb
+from app.core.columnar import negotiate, columnar_response
+from app.core.serialize import FastJSONResponse, rows_response
+from app.db.rollups import FLEET_AGGS, aggregate_query, fleet_query, snap_resolution
+from app.db.metric_registry import DEFAULT_METRICS, invalid_metrics, select_list
+from app.db.telemetry import ms_to_datetime
+from app.db.energy import BUCKET, bucket_floor
 
 
 router = APIRouter(prefix="/charts", tags=["Charts"])
 
 
-ALLOWED_METRICS = {
-	"thd_v_r",
-	"pf_total",
-	"frequency",
-	"energy_kwh",
-	"current_avg",
-	"voltage_ll_avg",
-	"active_power_total",
+BUCKET_AGGS = {
+	"avg": "avg({expr})",
+	"min": "min({expr})",
+	"max": "max({expr})",
+	"last": "last({expr}, ts)",
+}
+
+LTTB_MAX_SOURCE_ROWS = int(os.getenv("LTTB_MAX_SOURCE_ROWS", "200000"))
+FLEET_MAX_BUCKETS = int(os.getenv("FLEET_MAX_BUCKETS", "5000"))
+
+# scope kind -> query proving the scope belongs to the org
+SCOPE_SQL = {
+	"plant": "SELECT 1 FROM plant_master p JOIN site_master s ON p.site_id=s.site_id WHERE p.plant_id=%s AND s.org_id=%s",
+	"site": "SELECT 1 FROM site_master s WHERE s.site_id=%s AND s.org_id=%s",
 }
 
 
 @router.get("/overview/{device_id}")
-def overview(device_id: str, current_user = Depends(get_current_user)):
-	with get_db() as cur:
-		cur.execute(
-			"""
-			SELECT 1
-			FROM device_master d
-			JOIN plant_master p ON d.plant_id=p.plant_id
-			JOIN site_master s ON p.site_id=s.site_id
-			WHERE s.org_id=%s AND d.device_id=%s
-			""",
-			(current_user["org_id"], device_id),
-		)
-		if cur.fetchone() is None:
-			raise HTTPException(status_code=403, detail="Device not in your organisation")
-		cur.execute(
-			"""
-			SELECT ts,
-				(data->>'thd_v_r')::double precision AS thd_v_r,
-				(data->>'pf_total')::double precision AS pf_total,
-				(data->>'frequency')::double precision AS frequency,
-				(data->>'energy_kwh')::double precision AS energy_kwh,
-				(data->>'current_avg')::double precision AS current_avg,
-				(data->>'voltage_ll_avg')::double precision AS voltage_ll_avg,
-				(data->>'active_power_total')::double precision AS active_power_total
-			FROM telemetry
-			WHERE device_id=%s
-			ORDER BY ts DESC
-			LIMIT 1;
-			""",
-			(device_id,),
-		)
-		row = cur.fetchone()
-		if not row:
-			raise HTTPException(status_code=404, detail="No telemetry found")
-		return row
+async def overview(device_id: str, current_user = Depends(get_current_user)):
+	async with get_async_db(readonly=True) as cur:
+		await ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+		latest = await store.fetch_async(cur, device_id)
+	if latest is None:
+		raise HTTPException(status_code=404, detail="No telemetry found")
+	ts, data = latest
+	return FastJSONResponse({"ts": ts, **as_metrics(data, DEFAULT_METRICS)})
+
+
+async def _span_seconds(cur, where_sql: str, params: list, start_ms: int | None, end_ms: int | None) -> float:
+	if start_ms is not None and end_ms is not None:
+		return max(end_ms - start_ms, 0) / 1000
+	await cur.execute(f"SELECT min(ts) AS first, max(ts) AS last FROM telemetry WHERE {where_sql};", tuple(params))
+	row = await cur.fetchone()
+	if row["first"] is None:
+		return 0
+	first = start_ms / 1000 if start_ms is not None else row["first"].timestamp()
+	last = end_ms / 1000 if end_ms is not None else row["last"].timestamp()
+	return max(last - first, 0)
+
+
+async def _lttb_rows(cur, metrics: List[str], where_sql: str, params: list, max_points: int):
+	await cur.execute(
+		f"SELECT ts, {select_list(metrics)} FROM telemetry WHERE {where_sql} ORDER BY ts ASC LIMIT %s;",
+		tuple(params + [LTTB_MAX_SOURCE_ROWS + 1]),
+	)
+	rows = await cur.fetchall()
+	if len(rows) > LTTB_MAX_SOURCE_ROWS:
+		raise HTTPException(status_code=400, detail="Range too large for lttb, narrow it or use a bucket aggregate")
+	xs = [r[0].timestamp() for r in rows]
+	# split the point budget across metrics so the union stays near max_points
+	per_metric = max(3, max_points // len(metrics))
+	keep = set()
+	for i in range(1, len(metrics) + 1):
+		keep.update(lttb(xs, [r[i] for r in rows], per_metric))
+	return [rows[i] for i in sorted(keep)]
 
 
 @router.get("/timeseries/{device_id}")
-def timeseries(
+async def timeseries(
 	device_id: str,
-	metrics: List[str] = Query(default=[
-		"thd_v_r",
-		"pf_total",
-		"frequency",
-		"energy_kwh",
-		"current_avg",
-		"voltage_ll_avg",
-		"active_power_total",
-	]),
+	metrics: List[str] = Query(default=DEFAULT_METRICS),
 	start_ms: int | None = None,
 	end_ms: int | None = None,
 	limit: int = 500,
+	interval: str | None = None,
+	max_points: int | None = Query(default=None, ge=3),
+	agg: Literal["avg", "min", "max", "last", "lttb"] = "avg",
+	accept: str | None = Header(default=None),
 	current_user = Depends(get_current_user),
 ):
-	invalid = [m for m in metrics if m not in ALLOWED_METRICS]
+	invalid = invalid_metrics(metrics)
 	if invalid:
 		raise HTTPException(status_code=400, detail=f"Invalid metrics: {', '.join(invalid)}")
+	bucket_seconds = None
+	if interval is not None:
+		try:
+			bucket_seconds = parse_interval(interval)
+		except ValueError as e:
+			raise HTTPException(status_code=400, detail=str(e))
+	if agg == "lttb" and max_points is None:
+		raise HTTPException(status_code=400, detail="agg=lttb requires max_points")
 
-	selects = ["ts"] + [f"(data->>'{m}')::double precision AS {m}" for m in metrics]
-	select_sql = ", ".join(selects)
 	where = ["device_id=%s"]
 	params: list = [device_id]
 	if start_ms is not None:
@@ -89,23 +111,184 @@ def timeseries(
 		params.append(end_ms)
 	where_sql = " AND ".join(where)
 
-	with get_db() as cur:
-		cur.execute(
-			"""
-			SELECT 1
-			FROM device_master d
-			JOIN plant_master p ON d.plant_id=p.plant_id
-			JOIN site_master s ON p.site_id=s.site_id
-			WHERE s.org_id=%s AND d.device_id=%s
-			""",
-			(current_user["org_id"], device_id),
-		)
-		if cur.fetchone() is None:
-			raise HTTPException(status_code=403, detail="Device not in your organisation")
-		cur.execute(
-			f"SELECT {select_sql} FROM telemetry WHERE {where_sql} ORDER BY ts ASC LIMIT %s;",
-			tuple(params + [limit]),
-		)
-		return cur.fetchall()
+	async with get_async_db(readonly=True) as cur:
+		await ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+		# plain tuples for the series itself; rows become dicts only for row-JSON output
+		async with cur.connection.cursor(row_factory=tuple_row) as rows_cur:
+			if bucket_seconds is None and max_points is None:
+				await rows_cur.execute(
+					f"SELECT ts, {select_list(metrics)} FROM telemetry WHERE {where_sql} ORDER BY ts ASC LIMIT %s;",
+					tuple(params + [limit]),
+				)
+				rows = await rows_cur.fetchall()
+			elif agg == "lttb":
+				rows = await _lttb_rows(rows_cur, metrics, where_sql, params, max_points)
+			else:
+				if max_points is not None:
+					# time_bucket alignment can touch one extra bucket, hence max_points - 1
+					span = await _span_seconds(cur, where_sql, params, start_ms, end_ms)
+					bucket_seconds = max(bucket_seconds or 0, snap_resolution(span / (max_points - 1)), 0.001)
+
+				if agg != "last" and start_ms is not None:
+					# avg/min/max can be served from rollup tiers for the aligned part of the window
+					sql, agg_params = aggregate_query(
+						metrics,
+						[device_id],
+						ms_to_datetime(start_ms),
+						ms_to_datetime(end_ms) if end_ms is not None else None,
+						bucket_seconds,
+					)
+					columns = ", ".join(f"{m}_{agg}" for m in metrics)
+					await rows_cur.execute(
+						f"SELECT ts, {columns} FROM ({sql}) agg ORDER BY ts LIMIT %s;",
+						tuple(agg_params + [max_points or limit]),
+					)
+				else:
+					await rows_cur.execute(
+						f"SELECT time_bucket(make_interval(secs => %s), ts), {select_list(metrics, BUCKET_AGGS[agg])} FROM telemetry WHERE {where_sql} GROUP BY 1 ORDER BY 1 LIMIT %s;",
+						tuple([bucket_seconds] + params + [max_points or limit]),
+					)
+				rows = await rows_cur.fetchall()
+
+	names = ["ts"] + list(metrics)
+	media_type = negotiate(accept)
+	if media_type is not None:
+		return columnar_response(media_type, names, rows)
+	return rows_response(names, rows)
+
+
+@router.get("/energy/{device_id}")
+async def energy(
+	device_id: str,
+	start_ms: int,
+	end_ms: int | None = None,
+	interval: str = "1h",
+	accept: str | None = Header(default=None),
+	current_user = Depends(get_current_user),
+):
+	"""energy_kwh consumption per interval (whole hours, UTC-aligned) from the hourly ledger."""
+	try:
+		bucket_seconds = parse_interval(interval)
+	except ValueError as e:
+		raise HTTPException(status_code=400, detail=str(e))
+	if bucket_seconds % BUCKET.total_seconds():
+		raise HTTPException(status_code=400, detail="interval must be a whole number of hours")
+	params: list = [bucket_seconds, device_id, bucket_floor(ms_to_datetime(start_ms))]
+	where = "device_id=%s AND bucket >= %s"
+	if end_ms is not None:
+		where += " AND bucket < %s"
+		params.append(ms_to_datetime(end_ms))
+	async with get_async_db(readonly=True) as cur:
+		await ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+		async with cur.connection.cursor(row_factory=tuple_row) as rows_cur:
+			await rows_cur.execute(
+				f"""
+				SELECT time_bucket(make_interval(secs => %s), bucket) AS ts, sum(consumption), sum(resets), sum(samples)
+				FROM energy_hourly
+				WHERE {where}
+				GROUP BY 1
+				ORDER BY 1;
+				""",
+				tuple(params),
+			)
+			rows = await rows_cur.fetchall()
+
+	names = ["ts", "kwh", "resets", "samples"]
+	media_type = negotiate(accept)
+	if media_type is not None:
+		return columnar_response(media_type, names, rows)
+	return rows_response(names, rows)
+
+
+async def _fleet_timeseries(
+	kind: str,
+	scope_id: str,
+	metrics: List[str],
+	start_ms: int,
+	end_ms: int | None,
+	interval: str | None,
+	max_points: int,
+	aggs: List[str],
+	fill: str,
+	accept: str | None,
+	current_user: dict,
+):
+	invalid = invalid_metrics(metrics)
+	if invalid:
+		raise HTTPException(status_code=400, detail=f"Invalid metrics: {', '.join(invalid)}")
+	aggs = list(dict.fromkeys(aggs))
+	start = ms_to_datetime(start_ms)
+	end = ms_to_datetime(end_ms) if end_ms is not None else datetime.now(tz=timezone.utc)
+	span = (end - start).total_seconds()
+	if span <= 0:
+		raise HTTPException(status_code=400, detail="end_ms must be after start_ms")
+	if interval is not None:
+		try:
+			bucket_seconds = parse_interval(interval)
+		except ValueError as e:
+			raise HTTPException(status_code=400, detail=str(e))
+	else:
+		bucket_seconds = max(snap_resolution(span / (max_points - 1)), 1)
+	if span / bucket_seconds > FLEET_MAX_BUCKETS:
+		raise HTTPException(status_code=400, detail=f"More than {FLEET_MAX_BUCKETS} buckets, widen the interval")
+
+	async with get_async_db(readonly=True) as cur:
+		# the device set is resolved once; the series itself is a single statement over all of it
+		if kind == "plant":
+			devices = await scope_devices_async(cur, current_user["org_id"], plants=[scope_id])
+		else:
+			devices = await scope_devices_async(cur, current_user["org_id"], sites=[scope_id])
+		if not devices:
+			await cur.execute(SCOPE_SQL[kind], (scope_id, current_user["org_id"]))
+			if await cur.fetchone() is None:
+				raise HTTPException(status_code=404, detail=f"{kind.capitalize()} not found")
+			rows = []
+		else:
+			sql, params = fleet_query(metrics, sorted(devices), start, end, bucket_seconds, aggs, fill)
+			async with cur.connection.cursor(row_factory=tuple_row) as rows_cur:
+				await rows_cur.execute(sql, tuple(params))
+				rows = await rows_cur.fetchall()
+
+	names = ["ts", "devices"] + [f"{m}_{agg}" for m in metrics for agg in aggs]
+	media_type = negotiate(accept)
+	if media_type is not None:
+		return columnar_response(media_type, names, rows)
+	return rows_response(names, rows)
 
 
+@router.get("/plant/{plant_id}/timeseries")
+async def plant_timeseries(
+	plant_id: str,
+	start_ms: int,
+	metrics: List[str] = Query(default=["active_power_total", "energy_kwh"]),
+	end_ms: int | None = None,
+	interval: str | None = None,
+	max_points: int = Query(default=500, ge=3),
+	aggs: List[Literal["sum", "avg", "min", "max"]] = Query(default=list(FLEET_AGGS)),
+	fill: Literal["locf", "none"] = "locf",
+	accept: str | None = Header(default=None),
+	current_user = Depends(get_current_user),
+):
+	"""Per-bucket sum/avg/min/max across all devices of a plant."""
+	return await _fleet_timeseries(
+		"plant", plant_id, metrics, start_ms, end_ms, interval, max_points, aggs, fill, accept, current_user
+	)
+
+
+@router.get("/site/{site_id}/timeseries")
+async def site_timeseries(
+	site_id: str,
+	start_ms: int,
+	metrics: List[str] = Query(default=["active_power_total", "energy_kwh"]),
+	end_ms: int | None = None,
+	interval: str | None = None,
+	max_points: int = Query(default=500, ge=3),
+	aggs: List[Literal["sum", "avg", "min", "max"]] = Query(default=list(FLEET_AGGS)),
+	fill: Literal["locf", "none"] = "locf",
+	accept: str | None = Header(default=None),
+	current_user = Depends(get_current_user),
+):
+	"""Per-bucket sum/avg/min/max across all devices of a site."""
+	return await _fleet_timeseries(
+		"site", site_id, metrics, start_ms, end_ms, interval, max_points, aggs, fill, accept, current_user
+	)
@@ -1,42 +1,48 @@
-from fastapi import APIRouter, HTTPException, Depends
-from app.db import crud
-from app.db.connection import get_db
+from fastapi import APIRouter, HTTPException, Depends, Request
+from app.db import async_crud
+from app.db.async_connection import get_async_db
 from app.schemas.device import DeviceCreate, DeviceUpdate
 from app.core.auth import get_current_user
+from app.core import ownership, device_keys
+from app.core.conditional import conditional_json
+from app.core.serialize import FastJSONResponse
+from app.core.latest import store
 
 
 router = APIRouter(prefix="/device", tags=["Device"])
 
 
 @router.post("/")
-def create_device(device: DeviceCreate):
+async def create_device(device: DeviceCreate):
 	try:
-		return crud.create_record("device_master", device.dict())
+		created = await async_crud.create_record("device_master", device.dict())
 	except Exception as e:
 		raise HTTPException(status_code=400, detail=str(e))
+	ownership.invalidate(device.device_id)
+	return created
 
 
 @router.get("/")
-def list_devices(current_user = Depends(get_current_user)):
-	with get_db() as cur:
-		cur.execute(
-			"""
-			SELECT d.*
-			FROM device_master d
-			JOIN plant_master p ON d.plant_id=p.plant_id
-			JOIN site_master s ON p.site_id=s.site_id
-			WHERE s.org_id=%s
-			ORDER BY d.device_id
-			""",
-			(current_user["org_id"],),
-		)
-		return cur.fetchall()
+async def list_devices(request: Request, current_user = Depends(get_current_user)):
+	etag, rows = await async_crud.cached_query(
+		("device_master", current_user["org_id"]),
+		"""
+		SELECT d.*
+		FROM device_master d
+		JOIN plant_master p ON d.plant_id=p.plant_id
+		JOIN site_master s ON p.site_id=s.site_id
+		WHERE s.org_id=%s
+		ORDER BY d.device_id
+		""",
+		(current_user["org_id"],),
+	)
+	return conditional_json(request, etag, rows, vary="Authorization")
 
 
 @router.get("/{device_id}")
-def get_device(device_id: str, current_user = Depends(get_current_user)):
-	with get_db() as cur:
-		cur.execute(
+async def get_device(device_id: str, current_user = Depends(get_current_user)):
+	async with get_async_db(readonly=True) as cur:
+		await cur.execute(
 			"""
 			SELECT d.*
 			FROM device_master d
@@ -46,55 +52,75 @@ def get_device(device_id: str, current_user = Depends(get_current_user)):
 			""",
 			(current_user["org_id"], device_id),
 		)
-		row = cur.fetchone()
+		row = await cur.fetchone()
 	if not row:
 		raise HTTPException(status_code=404, detail="Device not found")
-	return row
+	return FastJSONResponse(row)
 
 
 @router.put("/{device_id}")
-def update_device(device_id: str, change: DeviceUpdate):
+async def update_device(device_id: str, change: DeviceUpdate):
 	data = {k: v for k, v in change.dict().items() if v is not None}
 	if not data:
 		raise HTTPException(status_code=400, detail="No fields to update")
-	updated = crud.update_by_id("device_master", "device_id", device_id, data)
+	updated = await async_crud.update_by_id("device_master", "device_id", device_id, data)
+	ownership.invalidate(device_id)
 	if not updated:
 		raise HTTPException(status_code=404, detail="Device not found")
 	return updated
 
 
 @router.delete("/{device_id}")
-def delete_device(device_id: str):
+async def delete_device(device_id: str):
 	# best-effort delete
-	crud.delete_by_id("device_master", "device_id", device_id)
+	await async_crud.delete_by_id("device_master", "device_id", device_id)
+	ownership.invalidate(device_id)
+	# its credentials went with it (ON DELETE CASCADE)
+	device_keys.invalidate()
+	store.drop(device_id)
 	return {"status": "deleted"}
 
 
 @router.get("/{device_id}/latest")
-def get_device_latest(device_id: str, current_user = Depends(get_current_user)):
-	with get_db() as cur:
-		cur.execute(
-			"""
-			SELECT 1
-			FROM device_master d
-			JOIN plant_master p ON d.plant_id=p.plant_id
-			JOIN site_master s ON p.site_id=s.site_id
-			WHERE s.org_id=%s AND d.device_id=%s
-			""",
-			(current_user["org_id"], device_id),
-		)
-		if cur.fetchone() is None:
-			raise HTTPException(status_code=403, detail="Device not in your organisation")
-		cur.execute(
+async def get_device_latest(device_id: str, current_user = Depends(get_current_user)):
+	async with get_async_db(readonly=True) as cur:
+		await ownership.ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+		latest = await store.fetch_async(cur, device_id)
+	if latest is None:
+		return None
+	ts, data = latest
+	return FastJSONResponse({"ts": ts, "data": data})
+
+
+@router.post("/{device_id}/keys")
+async def create_device_key(device_id: str, label: str | None = None, current_user = Depends(get_current_user)):
+	"""Issue an API key for X-Device-Key; the key itself is only returned here."""
+	async with get_async_db() as cur:
+		await ownership.ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+		return await device_keys.create_key(cur, device_id, label)
+
+
+@router.get("/{device_id}/keys")
+async def list_device_keys(device_id: str, current_user = Depends(get_current_user)):
+	async with get_async_db(readonly=True) as cur:
+		await ownership.ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+		await cur.execute(
 			"""
-			SELECT ts, data
-			FROM telemetry
+			SELECT key_id, label, created_at, revoked_at
+			FROM device_credential
 			WHERE device_id=%s
-			ORDER BY ts DESC
-			LIMIT 1;
+			ORDER BY created_at;
 			""",
 			(device_id,),
 		)
-		return cur.fetchone()
+		return await cur.fetchall()
 
 
+@router.delete("/{device_id}/keys/{key_id}")
+async def revoke_device_key(device_id: str, key_id: str, current_user = Depends(get_current_user)):
+	async with get_async_db() as cur:
+		await ownership.ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+		revoked = await device_keys.revoke_key(cur, device_id, key_id)
+	if not revoked:
+		raise HTTPException(status_code=404, detail="Key not found")
+	return {"status": "revoked"}
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from app.db import crud
+from app.core.conditional import conditional_json
 from app.schemas.organisation import OrgCreate
 
 
@@ -15,7 +16,8 @@ def create_org(org: OrgCreate):
 
 
 @router.get("/")
-def list_orgs():
-	return crud.get_all("organisation_master")
+def list_orgs(request: Request):
+	etag, rows = crud.get_all_cached("organisation_master")
+	return conditional_json(request, etag, rows)
 
 
@@ -1,5 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from app.db import crud
+from app.core.conditional import conditional_json
+from app.core import ownership
 from app.schemas.plant import PlantBase
 
 
@@ -8,11 +10,15 @@ router = APIRouter(prefix="/plant", tags=["Plant"])
 
 @router.post("/")
 def add_plant(plant: PlantBase):
-	return crud.create_record("plant_master", plant.dict())
+	created = crud.create_record("plant_master", plant.dict())
+	# drop cached "unknown device" answers that the new plant may resolve
+	ownership.invalidate()
+	return created
 
 
 @router.get("/")
-def get_plants():
-	return crud.get_all("plant_master")
+def get_plants(request: Request):
+	etag, rows = crud.get_all_cached("plant_master")
+	return conditional_json(request, etag, rows)
 
 
@@ -1,5 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from app.db import crud
+from app.core.conditional import conditional_json
+from app.core import ownership
 from app.schemas.site import SiteBase
 
 
@@ -8,11 +10,15 @@ router = APIRouter(prefix="/site", tags=["Site"])
 
 @router.post("/")
 def add_site(site: SiteBase):
-	return crud.create_record("site_master", site.dict())
+	created = crud.create_record("site_master", site.dict())
+	# drop cached "unknown device" answers that the new site may resolve
+	ownership.invalidate()
+	return created
 
 
 @router.get("/")
-def get_sites():
-	return crud.get_all("site_master")
+def get_sites(request: Request):
+	etag, rows = crud.get_all_cached("site_master")
+	return conditional_json(request, etag, rows)
 
 
@@ -1,66 +1,295 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
-from psycopg2.extras import Json
-from app.schemas.telemetry import TelemetryIn
-from app.db.connection import get_db
-from app.core.auth import get_current_user
+import asyncio
+import csv
+import io
+import json
+import os
+from collections import Counter
+from typing import List, Literal
+from fastapi import APIRouter, HTTPException, Query, Depends, Response, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from app.schemas.telemetry import TelemetryIn, TelemetryBatchIn
+from psycopg.rows import tuple_row
+from app.db.async_connection import get_async_db, get_async_stream_cursor
+from app.db.metric_registry import DEFAULT_METRICS, invalid_metrics, select_list
+from app.db.prepared import execute_async
+from app.db.telemetry import INSERT_ONE, dedupe_samples, insert_samples_async, ms_to_datetime, encode_cursor, decode_cursor
+from app.core.auth import get_current_user, get_ingest_principal, authenticate
+from app.core.ownership import ensure_device_in_org_async, owned_devices_async, scope_devices_async
+from app.core.ingest import get_buffer
+from app.core.latest import store
+from app.core.live import broker
+from app.core.alerts import engine as alerts
+from app.core.energy import ledger
+from app.core.columnar import negotiate, columnar_response
+from app.core.serialize import rows_response
 
 
 router = APIRouter(prefix="/telemetry", tags=["Telemetry"])
 
 
+BATCH_MAX_SAMPLES = int(os.getenv("TELEMETRY_BATCH_MAX", "10000"))
+EXPORT_FETCH_ROWS = int(os.getenv("TELEMETRY_EXPORT_FETCH_ROWS", "5000"))
+LIVE_HEARTBEAT_S = float(os.getenv("LIVE_HEARTBEAT_S", "15"))
+
+
 @router.post("/")
-def add_telemetry(data: TelemetryIn, current_user = Depends(get_current_user)):
-	with get_db() as cur:
-		# Ensure device belongs to user's org
-		cur.execute(
-			"""
-			SELECT 1
-			FROM device_master d
-			JOIN plant_master p ON d.plant_id=p.plant_id
-			JOIN site_master s ON p.site_id=s.site_id
-			WHERE s.org_id=%s AND d.device_id=%s
-			""",
-			(current_user["org_id"], data.device_id),
-		)
-		if cur.fetchone() is None:
-			raise HTTPException(status_code=403, detail="Device not in your organisation")
-		cur.execute(
-			"""
-			INSERT INTO telemetry (device_id, ts, data)
-			VALUES (%s, to_timestamp(%s/1000.0), %s::jsonb);
-			""",
-			(data.device_id, data.ts, Json(data.data)),
-		)
+async def add_telemetry(data: TelemetryIn, response: Response, current_user = Depends(get_ingest_principal)):
+	if current_user.get("device_id") not in (None, data.device_id):
+		raise HTTPException(status_code=403, detail="Device key does not cover this device")
+	buffer = get_buffer()
+	# rule state advanced by evaluate() is put back if the transaction does not commit
+	with alerts.staged() as undo:
+		async with get_async_db() as cur:
+			await ensure_device_in_org_async(cur, current_user["org_id"], data.device_id)
+			if buffer is not None:
+				if not buffer.put((data.device_id, data.ts, data.data)):
+					raise HTTPException(status_code=503, detail="Ingest queue full", headers={"Retry-After": "1"})
+				response.status_code = 202
+				return {"status": "queued"}
+			await execute_async(cur, INSERT_ONE, (data.device_id, data.ts, json.dumps(data.data)))
+			await broker.notify_async(cur, [(data.device_id, data.ts, data.data)])
+			await alerts.record_async(cur, alerts.evaluate([(data.device_id, data.ts, data.data)], undo=undo))
+	store.observe(data.device_id, ms_to_datetime(data.ts), data.data)
+	broker.publish([(data.device_id, data.ts, data.data)])
+	ledger.observe([(data.device_id, data.ts, data.data)])
 	return {"status": "ok"}
 
 
+@router.post("/batch")
+async def add_telemetry_batch(batch: TelemetryBatchIn, current_user = Depends(get_ingest_principal)):
+	if not batch.samples:
+		raise HTTPException(status_code=400, detail="No samples provided")
+	if len(batch.samples) > BATCH_MAX_SAMPLES:
+		raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_SAMPLES} samples")
+
+	received = Counter(s.device_id for s in batch.samples)
+	with alerts.staged() as undo:
+		async with get_async_db() as cur:
+			owned = await owned_devices_async(cur, current_user["org_id"], received)
+			if current_user.get("device_id") is not None:
+				# a device key only writes its own device
+				owned &= {current_user["device_id"]}
+			kept = [(s.device_id, s.ts, s.data) for s in batch.samples if s.device_id in owned]
+			rows, _ = dedupe_samples(kept, batch.on_conflict)
+			written = await insert_samples_async(cur, rows, batch.on_conflict)
+			await broker.notify_async(cur, rows, written)
+			await alerts.record_async(cur, alerts.evaluate(rows, written, undo))
+	store.record_written(rows, written, batch.on_conflict)
+	broker.publish(rows, written)
+	ledger.observe(rows, written)
+
+	accepted = Counter(device_id for device_id, _ in written)
+	# under overwrite/merge, in-batch duplicates are folded into the row that was written
+	merged = Counter()
+	if batch.on_conflict != "skip":
+		merged = Counter(d for d, _, _ in kept) - Counter(d for d, _, _ in rows)
+	devices = {}
+	for device_id, count in received.items():
+		entry = {
+			"accepted": accepted[device_id],
+			"merged": merged[device_id],
+			"rejected": count - accepted[device_id] - merged[device_id],
+		}
+		if device_id not in owned:
+			entry["error"] = "Device not in your organisation" if current_user.get("device_id") is None else "Device key does not cover this device"
+		devices[device_id] = entry
+	return {
+		"accepted": sum(d["accepted"] for d in devices.values()),
+		"merged": sum(d["merged"] for d in devices.values()),
+		"rejected": sum(d["rejected"] for d in devices.values()),
+		"devices": devices,
+	}
+
+
+@router.get("/ingest/stats")
+async def ingest_stats(current_user = Depends(get_current_user)):
+	buffer = get_buffer()
+	if buffer is None:
+		return {"mode": "sync"}
+	return {"mode": "async", **buffer.stats()}
+
+
+def _stream_token(token: str | None, authorization: str | None) -> str:
+	# browsers cannot set headers on WebSocket/EventSource, so ?token= is accepted too
+	if authorization and authorization.lower().startswith("bearer "):
+		return authorization[7:]
+	if token:
+		return token
+	raise HTTPException(status_code=401, detail="Not authenticated")
+
+
+async def _subscribe(current_user: dict, devices, plants, sites):
+	async with get_async_db() as cur:
+		device_ids = await scope_devices_async(cur, current_user["org_id"], devices, plants, sites)
+	return broker.subscribe(device_ids)
+
+
+def _live_message(sub, samples) -> dict:
+	return {"samples": samples, "coalesced": sub.coalesced, "dropped": sub.dropped}
+
+
+async def _pump(websocket: WebSocket, sub) -> dict:
+	"""Send batches until the client sends a new subscription, which is returned."""
+	receive = asyncio.ensure_future(websocket.receive_json())
+	try:
+		while True:
+			send = asyncio.ensure_future(sub.next())
+			done, _ = await asyncio.wait({receive, send}, return_when=asyncio.FIRST_COMPLETED)
+			if send in done:
+				await websocket.send_json(_live_message(sub, send.result()))
+			else:
+				send.cancel()
+			if receive in done:
+				message = receive.result()
+				return {k: list(message.get(k) or []) for k in ("devices", "plants", "sites")}
+	finally:
+		receive.cancel()
+
+
+@router.websocket("/stream")
+async def stream_telemetry(
+	websocket: WebSocket,
+	token: str | None = None,
+	devices: List[str] = Query(default=[]),
+	plants: List[str] = Query(default=[]),
+	sites: List[str] = Query(default=[]),
+	authorization: str | None = Header(default=None),
+):
+	try:
+		current_user = await authenticate(_stream_token(token, authorization))
+	except HTTPException as e:
+		await websocket.close(code=1008, reason=e.detail)
+		return
+	await websocket.accept()
+	scope = {"devices": devices, "plants": plants, "sites": sites}
+	sub = None
+	try:
+		while True:
+			if sub is not None:
+				broker.unsubscribe(sub)
+			sub = await _subscribe(current_user, **scope)
+			if sub is None:
+				await websocket.close(code=1013, reason="Too many live subscribers")
+				return
+			await websocket.send_json({"subscribed": sorted(sub.devices)})
+			scope = await _pump(websocket, sub)
+	except WebSocketDisconnect:
+		pass
+	except (ValueError, AttributeError):
+		await websocket.close(code=1003, reason="Expected {devices, plants, sites}")
+	finally:
+		if sub is not None:
+			broker.unsubscribe(sub)
+
+
+async def _sse_events(sub):
+	try:
+		yield f"event: subscribed\ndata: {json.dumps(sorted(sub.devices))}\n\n"
+		while True:
+			samples = await sub.next(LIVE_HEARTBEAT_S)
+			if samples:
+				yield f"data: {json.dumps(_live_message(sub, samples))}\n\n"
+			else:
+				# keeps proxies from timing out an idle stream
+				yield ": keepalive\n\n"
+	finally:
+		broker.unsubscribe(sub)
+
+
+@router.get("/stream/sse")
+async def stream_telemetry_sse(
+	token: str | None = None,
+	devices: List[str] = Query(default=[]),
+	plants: List[str] = Query(default=[]),
+	sites: List[str] = Query(default=[]),
+	authorization: str | None = Header(default=None),
+):
+	current_user = await authenticate(_stream_token(token, authorization))
+	sub = await _subscribe(current_user, devices, plants, sites)
+	if sub is None:
+		raise HTTPException(status_code=503, detail="Too many live subscribers", headers={"Retry-After": "5"})
+	return StreamingResponse(
+		_sse_events(sub),
+		media_type="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+	)
+
+
+@router.get("/stream/stats")
+async def stream_stats(current_user = Depends(get_current_user)):
+	return broker.stats()
+
+
+def _parse_cursor(cursor: str | None):
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/")
-def list_telemetry(limit: int = 100, current_user = Depends(get_current_user)):
-    with get_db() as cur:
-        cur.execute(
-            """
-            SELECT t.device_id, t.ts, t.data
-            FROM telemetry t
-            JOIN device_master d ON t.device_id=d.device_id
-            JOIN plant_master p ON d.plant_id=p.plant_id
-            JOIN site_master s ON p.site_id=s.site_id
-            WHERE s.org_id=%s
-            ORDER BY t.ts DESC
-            LIMIT %s;
-            """,
-            (current_user["org_id"], limit),
-        )
-        return cur.fetchall()
+async def list_telemetry(
+    limit: int = 100,
+    cursor: str | None = None,
+    current_user = Depends(get_current_user),
+):
+    position = _parse_cursor(cursor)
+    # Top-N per device through idx_telemetry_device_ts, then merge: a page costs
+    # one index seek per org device however deep the cursor is
+    seek_sql = ""
+    params: list = []
+    if position is not None:
+        # d.device_id is constant inside the LATERAL, so ts <= cursor is the index bound
+        seek_sql = "AND t.ts <= %s AND (t.ts < %s OR d.device_id < %s)"
+        params += [position[0], position[0], position[1]]
+    async with get_async_db(readonly=True) as cur:
+        # tuples plus the JSONB as text: the documents go to the client without a parse/encode round trip
+        async with cur.connection.cursor(row_factory=tuple_row) as rows_cur:
+            await rows_cur.execute(
+                f"""
+                SELECT d.device_id, t.ts, t.data::text
+                FROM device_master d
+                JOIN plant_master p ON d.plant_id=p.plant_id
+                JOIN site_master s ON p.site_id=s.site_id
+                CROSS JOIN LATERAL (
+                    SELECT t.ts, t.data
+                    FROM telemetry t
+                    WHERE t.device_id=d.device_id {seek_sql}
+                    ORDER BY t.ts DESC
+                    LIMIT %s
+                ) t
+                WHERE s.org_id=%s
+                ORDER BY t.ts DESC, d.device_id DESC
+                LIMIT %s;
+                """,
+                tuple(params + [limit, current_user["org_id"], limit]),
+            )
+            rows = await rows_cur.fetchall()
+    headers = {}
+    if len(rows) == limit and rows:
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1][1], rows[-1][0])
+    return rows_response(["device_id", "ts", "data"], rows, raw=("data",), headers=headers)
 
 
 @router.get("/{device_id}")
-def get_device_telemetry(
+async def get_device_telemetry(
     device_id: str,
     start_ms: int | None = None,
     end_ms: int | None = None,
     limit: int = 100,
+    cursor: str | None = None,
+    metrics: List[str] | None = Query(default=None),
+    accept: str | None = Header(default=None),
     current_user = Depends(get_current_user),
 ):
+    position = _parse_cursor(cursor)
+    media_type = negotiate(accept)
+    metrics = metrics or DEFAULT_METRICS
+    invalid = invalid_metrics(metrics)
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid metrics: {', '.join(invalid)}")
     params = [device_id]
     where = ["device_id=%s"]
     if start_ms is not None:
@@ -69,80 +298,134 @@ def get_device_telemetry(
     if end_ms is not None:
         where.append("ts <= to_timestamp(%s/1000.0)")
         params.append(end_ms)
+    if position is not None:
+        where.append("ts < %s")
+        params.append(position[0])
     where_sql = " AND ".join(where)
-    with get_db() as cur:
-        cur.execute(
-            """
-            SELECT 1
-            FROM device_master d
-            JOIN plant_master p ON d.plant_id=p.plant_id
-            JOIN site_master s ON p.site_id=s.site_id
-            WHERE s.org_id=%s AND d.device_id=%s
-            """,
-            (current_user["org_id"], device_id),
-        )
-        if cur.fetchone() is None:
-            raise HTTPException(status_code=403, detail="Device not in your organisation")
-        cur.execute(
-            f"SELECT device_id, ts, data FROM telemetry WHERE {where_sql} ORDER BY ts DESC LIMIT %s;",
-            tuple(params + [limit]),
-        )
-        return cur.fetchall()
+    async with get_async_db(readonly=True) as cur:
+        await ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+        if media_type is not None:
+            # columnar: one typed array per metric instead of the raw JSONB documents
+            select_sql = "ts, " + select_list(metrics)
+            async with cur.connection.cursor(row_factory=tuple_row) as rows_cur:
+                await rows_cur.execute(
+                    f"SELECT {select_sql} FROM telemetry WHERE {where_sql} ORDER BY ts DESC LIMIT %s;",
+                    tuple(params + [limit]),
+                )
+                rows = await rows_cur.fetchall()
+            columnar = columnar_response(media_type, ["ts"] + list(metrics), rows)
+            if len(rows) == limit and rows:
+                columnar.headers["X-Next-Cursor"] = encode_cursor(rows[-1][0], device_id)
+            return columnar
+        async with cur.connection.cursor(row_factory=tuple_row) as rows_cur:
+            await rows_cur.execute(
+                f"SELECT device_id, ts, data::text FROM telemetry WHERE {where_sql} ORDER BY ts DESC LIMIT %s;",
+                tuple(params + [limit]),
+            )
+            rows = await rows_cur.fetchall()
+    headers = {}
+    if len(rows) == limit and rows:
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1][1], device_id)
+    return rows_response(["device_id", "ts", "data"], rows, raw=("data",), headers=headers)
+
+
+async def _export_chunks(sql: str, params: tuple, metrics: List[str] | None, fmt: str):
+	# rows are (ts, data_text) without a projection, (ts, *metric values) with one
+	async with get_async_stream_cursor(EXPORT_FETCH_ROWS, readonly=True) as cur:
+		await cur.execute(sql, params)
+		if fmt == "csv":
+			yield ",".join(["ts"] + (metrics or ["data"])) + "\n"
+		while True:
+			rows = await cur.fetchmany(EXPORT_FETCH_ROWS)
+			if not rows:
+				break
+			if fmt == "csv":
+				out = io.StringIO()
+				writer = csv.writer(out, lineterminator="\n")
+				writer.writerows((row[0].isoformat(), *row[1:]) for row in rows)
+				yield out.getvalue()
+			elif metrics:
+				yield "".join(
+					json.dumps({"ts": row[0].isoformat(), **dict(zip(metrics, row[1:]))}) + "\n"
+					for row in rows
+				)
+			else:
+				# JSONB text is already valid JSON, splice it in without re-parsing
+				yield "".join(f'{{"ts": "{row[0].isoformat()}", "data": {row[1]}}}\n' for row in rows)
+
+
+@router.get("/{device_id}/export")
+async def export_device_telemetry(
+    device_id: str,
+    start_ms: int | None = None,
+    end_ms: int | None = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    metrics: List[str] | None = Query(default=None),
+    current_user = Depends(get_current_user),
+):
+    if metrics:
+        invalid = invalid_metrics(metrics)
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Invalid metrics: {', '.join(invalid)}")
+    params = [device_id]
+    where = ["device_id=%s"]
+    if start_ms is not None:
+        where.append("ts >= to_timestamp(%s/1000.0)")
+        params.append(start_ms)
+    if end_ms is not None:
+        where.append("ts <= to_timestamp(%s/1000.0)")
+        params.append(end_ms)
+    where_sql = " AND ".join(where)
+    async with get_async_db(readonly=True) as cur:
+        await ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+
+    if metrics:
+        select_sql = "ts, " + select_list(metrics)
+    else:
+        select_sql = "ts, data::text"
+    sql = f"SELECT {select_sql} FROM telemetry WHERE {where_sql} ORDER BY ts ASC;"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_chunks(sql, tuple(params), metrics, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{device_id}.{format}"'},
+    )
 
 
 @router.delete("/{device_id}/{ts_ms}")
-def delete_telemetry(device_id: str, ts_ms: int, current_user = Depends(get_current_user)):
-    with get_db() as cur:
-        # Ensure device belongs to user's org
-        cur.execute(
-            """
-            SELECT 1
-            FROM device_master d
-            JOIN plant_master p ON d.plant_id=p.plant_id
-            JOIN site_master s ON p.site_id=s.site_id
-            WHERE s.org_id=%s AND d.device_id=%s
-            """,
-            (current_user["org_id"], device_id),
-        )
-        if cur.fetchone() is None:
-            raise HTTPException(status_code=403, detail="Device not in your organisation")
-        cur.execute(
+async def delete_telemetry(device_id: str, ts_ms: int, current_user = Depends(get_current_user)):
+    async with get_async_db() as cur:
+        await ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+        await cur.execute(
             "DELETE FROM telemetry WHERE device_id=%s AND ts=to_timestamp(%s/1000.0);",
             (device_id, ts_ms),
         )
+        if store.is_latest(device_id, ms_to_datetime(ts_ms)):
+            await store.load_async(cur, device_id)
+    ledger.touch(device_id, ts_ms)
     return {"status": "deleted"}
 
 
 @router.put("/{device_id}/{ts_ms}")
-def update_telemetry(device_id: str, ts_ms: int, payload: dict, current_user = Depends(get_current_user)):
+async def update_telemetry(device_id: str, ts_ms: int, payload: dict, current_user = Depends(get_current_user)):
     if not payload:
         raise HTTPException(status_code=400, detail="No data provided")
-    with get_db() as cur:
-        # Ensure device belongs to user's org
-        cur.execute(
-            """
-            SELECT 1
-            FROM device_master d
-            JOIN plant_master p ON d.plant_id=p.plant_id
-            JOIN site_master s ON p.site_id=s.site_id
-            WHERE s.org_id=%s AND d.device_id=%s
-            """,
-            (current_user["org_id"], device_id),
-        )
-        if cur.fetchone() is None:
-            raise HTTPException(status_code=403, detail="Device not in your organisation")
-        cur.execute(
+    async with get_async_db() as cur:
+        await ensure_device_in_org_async(cur, current_user["org_id"], device_id)
+        await cur.execute(
             """
             UPDATE telemetry
             SET data = data || %s::jsonb
             WHERE device_id=%s AND ts=to_timestamp(%s/1000.0)
             RETURNING device_id, ts, data;
             """,
-            (Json(payload), device_id, ts_ms),
+            (json.dumps(payload), device_id, ts_ms),
         )
-        row = cur.fetchone()
+        row = await cur.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Telemetry not found")
-        return row
+    store.replace(device_id, row["ts"], row["data"])
+    ledger.observe([(device_id, ts_ms, payload)])
+    return row
 
 
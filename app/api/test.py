@@ -1,15 +1,23 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter, Query, Depends
+from datetime import datetime, timedelta, timezone
 from typing import List, Any, Dict
 from app.db.connection import get_db
-from app.api.charts import ALLOWED_METRICS
+from app.db.rollups import aggregate_query
+from app.db.metric_registry import allowed_metrics, metric_expr
 from app.core.auth import get_current_user
+from app.core.latest import store, as_metrics
 
 
 router = APIRouter(prefix="/test", tags=["Test"])
 
 
+MAX_CONCURRENCY = int(os.getenv("TEST_RUN_MAX_CONCURRENCY", "8"))
+
+
 def _fetch_devices(org_id: str, limit: int | None = None, only_device_id: str | None = None):
-	with get_db() as cur:
+	with get_db(readonly=True) as cur:
 		if only_device_id:
 			cur.execute(
 				"""
@@ -52,61 +60,86 @@ def _fetch_devices(org_id: str, limit: int | None = None, only_device_id: str |
 		return [r["device_id"] for r in rows]
 
 
-def _fetch_overview(device_id: str):
-	selects = [
-		"ts",
-	] + [f"(data->>'{m}')::double precision AS {m}" for m in ALLOWED_METRICS]
-	select_sql = ", ".join(selects)
-	with get_db() as cur:
+def _metric_selects() -> str:
+	return ", ".join(f"{metric_expr(m)} AS {m}" for m in sorted(allowed_metrics()))
+
+
+def _fetch_overviews(cur, device_ids: List[str]) -> Dict[str, Any]:
+	overviews: Dict[str, Any] = {}
+	missing = []
+	for did in device_ids:
+		latest = store.get(did)
+		if latest is None:
+			missing.append(did)
+		else:
+			overviews[did] = {"ts": latest[0], **as_metrics(latest[1], allowed_metrics())}
+	if missing:
 		cur.execute(
-			f"""
-			SELECT {select_sql}
-			FROM telemetry
-			WHERE device_id=%s
-			ORDER BY ts DESC
-			LIMIT 1;
+			"""
+			SELECT d.device_id, t.ts, t.data
+			FROM unnest(%s::text[]) AS d(device_id)
+			CROSS JOIN LATERAL (
+				SELECT ts, data
+				FROM telemetry
+				WHERE device_id=d.device_id
+				ORDER BY ts DESC
+				LIMIT 1
+			) t;
 			""",
-			(device_id,),
+			(missing,),
 		)
-		return cur.fetchone()
+		for row in cur.fetchall():
+			store.observe(row["device_id"], row["ts"], row["data"])
+			overviews[row["device_id"]] = {"ts": row["ts"], **as_metrics(row["data"], allowed_metrics())}
+	return overviews
 
 
-def _fetch_timeseries(device_id: str, hours: int, limit: int):
-	selects = [
-		"ts",
-	] + [f"(data->>'{m}')::double precision AS {m}" for m in ALLOWED_METRICS]
-	select_sql = ", ".join(selects)
-	with get_db() as cur:
-		cur.execute(
-			f"""
-			SELECT {select_sql}
+def _fetch_timeseries(cur, device_ids: List[str], hours: int, limit: int) -> Dict[str, list]:
+	cur.execute(
+		f"""
+		SELECT d.device_id, t.*
+		FROM unnest(%s::text[]) AS d(device_id)
+		CROSS JOIN LATERAL (
+			SELECT ts, {_metric_selects()}
 			FROM telemetry
-			WHERE device_id=%s AND ts >= now() - (%s || ' hours')::interval
+			WHERE device_id=d.device_id AND ts >= now() - make_interval(hours => %s)
 			ORDER BY ts ASC
-			LIMIT %s;
-			""",
-			(device_id, str(hours), limit),
-		)
-		return cur.fetchall()
+			LIMIT %s
+		) t;
+		""",
+		(device_ids, hours, limit),
+	)
+	series: Dict[str, list] = {did: [] for did in device_ids}
+	for row in cur.fetchall():
+		series[row.pop("device_id")].append(row)
+	return series
 
 
-def _fetch_analytics(device_id: str, hours: int):
-	aggs = []
-	for m in ALLOWED_METRICS:
-		aggs.append(f"avg((data->>'{m}')::double precision) AS {m}_avg")
-		aggs.append(f"min((data->>'{m}')::double precision) AS {m}_min")
-		aggs.append(f"max((data->>'{m}')::double precision) AS {m}_max")
-	agg_sql = ", ".join(aggs)
-	with get_db() as cur:
-		cur.execute(
-			f"""
-			SELECT {agg_sql}
-			FROM telemetry
-			WHERE device_id=%s AND ts >= now() - (%s || ' hours')::interval;
-			""",
-			(device_id, str(hours)),
-		)
-		return cur.fetchone()
+def _fetch_analytics(cur, device_ids: List[str], hours: int) -> Dict[str, Any]:
+	metrics = sorted(allowed_metrics())
+	start = datetime.now(tz=timezone.utc) - timedelta(hours=hours)
+	sql, params = aggregate_query(metrics, device_ids, start)
+	cur.execute(sql, params)
+	empty = {f"{m}_{agg}": None for m in metrics for agg in ("avg", "min", "max")}
+	analytics = {did: dict(empty) for did in device_ids}
+	for row in cur.fetchall():
+		analytics[row.pop("device_id")] = row
+	return analytics
+
+
+def _health_report(device_ids: List[str], hours: int, timeseries_limit: int) -> Dict[str, Any]:
+	with get_db(readonly=True) as cur:
+		overviews = _fetch_overviews(cur, device_ids)
+		series = _fetch_timeseries(cur, device_ids, hours, timeseries_limit)
+		analytics = _fetch_analytics(cur, device_ids, hours)
+	return {
+		did: {
+			"overview": overviews.get(did),
+			"timeseries_sample": series[did],
+			"analytics": analytics[did],
+		}
+		for did in device_ids
+	}
 
 
 @router.get("/run")
@@ -115,6 +148,7 @@ def run(
 	device_limit: int = 5,
 	hours: int = 24,
 	timeseries_limit: int = 50,
+	concurrency: int = Query(default=1, ge=1, le=MAX_CONCURRENCY),
     current_user: Dict[str, Any] = Depends(get_current_user),
 ):
 	device_ids = _fetch_devices(
@@ -123,15 +157,16 @@ def run(
 		only_device_id=device_id,
 	)
 	results: Dict[str, Any] = {"devices_tested": device_ids, "results": {}}
-	for did in device_ids:
-		overview = _fetch_overview(did)
-		ts = _fetch_timeseries(did, hours=hours, limit=timeseries_limit)
-		analytics = _fetch_analytics(did, hours=hours)
-		results["results"][did] = {
-			"overview": overview,
-			"timeseries_sample": ts,
-			"analytics": analytics,
-		}
+	if not device_ids:
+		return results
+	# optional fan-out: each chunk is one connection running the same few set-based queries
+	chunk = -(-len(device_ids) // concurrency)
+	chunks = [device_ids[i:i + chunk] for i in range(0, len(device_ids), chunk)]
+	if len(chunks) == 1:
+		reports = [_health_report(device_ids, hours, timeseries_limit)]
+	else:
+		with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+			reports = list(pool.map(lambda ids: _health_report(ids, hours, timeseries_limit), chunks))
+	for report in reports:
+		results["results"].update(report)
 	return results
-
-
@@ -1,25 +1,30 @@
-from fastapi import APIRouter
-from passlib.hash import pbkdf2_sha256
-from app.db import crud
+from fastapi import APIRouter, Request
+from app.db import crud, async_crud
+from app.core.conditional import conditional_json
 from app.schemas.user import UserBase
+from app.core.auth import invalidate_principal
+from app.core.passwords import hash_password
 
 
 router = APIRouter(prefix="/user", tags=["User"])
 
 
 @router.post("/")
-def create_user(user: UserBase):
+async def create_user(user: UserBase):
 	user_data = {
 		"username": user.username,
-		"password": pbkdf2_sha256.hash(user.password),
+		"password": await hash_password(user.password),
 		"org_id": user.org_id,
 		"role": user.role,
 	}
-	return crud.create_record("user_master", user_data)
+	created = await async_crud.create_record("user_master", user_data)
+	invalidate_principal(user.username)
+	return created
 
 
 @router.get("/")
-def list_users():
-	return crud.get_all("user_master")
+def list_users(request: Request):
+	etag, rows = crud.get_all_cached("user_master")
+	return conditional_json(request, etag, rows)
 
 
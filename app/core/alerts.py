@@ -0,0 +1,363 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
+from app.db.async_connection import get_async_db
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_S = float(os.getenv("ALERT_CHECKPOINT_S", "30"))
+# picks up rule changes made through other workers
+RULES_REFRESH_S = float(os.getenv("ALERT_RULES_REFRESH_S", "60"))
+
+RULE_COLUMNS = "rule_id, device_id, metric, kind, lower, upper, max_rate, z_limit, alpha, min_samples, cooldown_s"
+STATE_COLUMNS = "rule_id, last_ts, last_value, n, mean, m2, active, last_fired"
+
+RULES_SQL = f"SELECT {RULE_COLUMNS} FROM alert_rule WHERE enabled;"
+STATES_SQL = f"SELECT {STATE_COLUMNS} FROM alert_state;"
+
+CHECKPOINT_SQL = f"""
+	INSERT INTO alert_state ({STATE_COLUMNS}, updated_at)
+	VALUES (%s, %s, %s, %s, %s, %s, %s, %s, now())
+	ON CONFLICT (rule_id) DO UPDATE SET
+		last_ts = EXCLUDED.last_ts, last_value = EXCLUDED.last_value, n = EXCLUDED.n,
+		mean = EXCLUDED.mean, m2 = EXCLUDED.m2, active = EXCLUDED.active,
+		last_fired = EXCLUDED.last_fired, updated_at = now();
+"""
+
+EVENT_SQL = """
+	INSERT INTO alert_event (rule_id, device_id, metric, kind, status, ts, value, score)
+	VALUES (%s, %s, %s, %s, %s, to_timestamp(%s/1000.0), %s, %s);
+"""
+
+
+@dataclass(frozen=True)
+class Rule:
+	rule_id: int
+	device_id: str
+	metric: str
+	kind: str  # threshold | rate | zscore
+	lower: float | None = None
+	upper: float | None = None
+	max_rate: float | None = None  # units per second
+	z_limit: float | None = None
+	alpha: float | None = None  # EW weight for zscore; None keeps a cumulative Welford estimate
+	min_samples: int = 30
+	cooldown_s: float = 300
+
+
+@dataclass
+class State:
+	last_ts: int | None = None  # ms
+	last_value: float | None = None
+	n: int = 0
+	mean: float = 0.0
+	m2: float = 0.0  # Welford sum of squared deviations, or the EW variance when alpha is set
+	active: bool = False
+	last_fired: int | None = None  # ms
+
+	def variance(self, alpha: float | None) -> float:
+		if alpha is not None:
+			return self.m2
+		return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+	def observe(self, x: float, alpha: float | None):
+		self.n += 1
+		if alpha is None:
+			delta = x - self.mean
+			self.mean += delta / self.n
+			self.m2 += delta * (x - self.mean)
+		elif self.n == 1:
+			self.mean, self.m2 = x, 0.0
+		else:
+			delta = x - self.mean
+			step = alpha * delta
+			self.mean += step
+			self.m2 = (1 - alpha) * (self.m2 + delta * step)
+
+
+def _number(value) -> float | None:
+	try:
+		x = float(value)
+	except (TypeError, ValueError):
+		return None
+	return x if math.isfinite(x) else None
+
+
+def _score(rule: Rule, state: State, ts: int, x: float):
+	"""(breached, score) for a sample against the state before it."""
+	if rule.kind == "threshold":
+		breached = (rule.lower is not None and x < rule.lower) or (rule.upper is not None and x > rule.upper)
+		return breached, x
+	if rule.kind == "rate":
+		if state.last_ts is None:
+			return False, None
+		rate = (x - state.last_value) / ((ts - state.last_ts) / 1000)
+		return abs(rate) > rule.max_rate, rate
+	if state.n < max(rule.min_samples, 2):
+		return False, None
+	std = math.sqrt(state.variance(rule.alpha))
+	if std == 0:
+		return False, None
+	z = (x - state.mean) / std
+	return abs(z) > rule.z_limit, z
+
+
+def step(rule: Rule, state: State, ts: int, x: float) -> dict | None:
+	"""Advance one rule by one sample in O(1); returns a firing/resolved event or None."""
+	breached, score = _score(rule, state, ts, x)
+	state.last_ts, state.last_value = ts, x
+	if rule.kind == "zscore":
+		state.observe(x, rule.alpha)
+	status = None
+	if breached and not state.active:
+		# a rule that keeps flapping fires at most once per cooldown
+		if state.last_fired is None or ts - state.last_fired >= rule.cooldown_s * 1000:
+			state.active, state.last_fired, status = True, ts, "firing"
+	elif not breached and state.active:
+		state.active, status = False, "resolved"
+	if status is None:
+		return None
+	return {
+		"rule_id": rule.rule_id,
+		"device_id": rule.device_id,
+		"metric": rule.metric,
+		"kind": rule.kind,
+		"status": status,
+		"ts": ts,
+		"value": x,
+		"score": score,
+	}
+
+
+def _rule(row) -> Rule:
+	return Rule(**{f.name: row[f.name] for f in fields(Rule) if row.get(f.name) is not None})
+
+
+def _same_series(old: Rule | None, new: Rule) -> bool:
+	# whether running state built under ``old`` still means the same under ``new``
+	return old is not None and (old.device_id, old.metric, old.kind, old.alpha) == (new.device_id, new.metric, new.kind, new.alpha)
+
+
+def _state(row) -> State:
+	return State(**{f.name: row[f.name] for f in fields(State) if row.get(f.name) is not None})
+
+
+class AlertEngine:
+	"""Per-device rules evaluated on the ingest paths.
+
+	Each rule keeps O(1) running state (last sample, mean/variance) in memory,
+	so a sample is checked without reading history. Changed state is written to
+	alert_state every ``CHECKPOINT_S`` seconds and on shutdown, and restored on
+	startup. State only sees the samples this process ingests.
+	"""
+
+	def __init__(self):
+		self._rules: dict = {}  # device_id -> [Rule]
+		self._state: dict = {}  # rule_id -> State
+		self._dirty: set = set()
+		self._lock = threading.Lock()
+		self._task: asyncio.Task | None = None
+		self.evaluated = 0
+		self.events = 0
+
+	def _install(self, rule_rows, state_rows):
+		rules = [_rule(row) for row in rule_rows]
+		saved = {row["rule_id"]: row for row in state_rows}
+		with self._lock:
+			installed = {r.rule_id: r for device_rules in self._rules.values() for r in device_rules}
+			by_device: dict = {}
+			states = {}
+			for rule in rules:
+				by_device.setdefault(rule.device_id, []).append(rule)
+				current = self._state.get(rule.rule_id)
+				if current is not None and not _same_series(installed.get(rule.rule_id), rule):
+					# redefined through another worker: the old statistics do not apply
+					current = State()
+					self._dirty.add(rule.rule_id)
+				elif current is None and rule.rule_id in saved:
+					current = _state(saved[rule.rule_id])
+				states[rule.rule_id] = current or State()
+			self._rules, self._state = by_device, states
+			self._dirty &= states.keys()
+
+	async def load_async(self, cur):
+		await cur.execute(RULES_SQL)
+		rules = await cur.fetchall()
+		await cur.execute(STATES_SQL)
+		self._install(rules, await cur.fetchall())
+
+	def put_rule(self, row):
+		"""Install a created/updated rule; a changed definition starts from fresh state."""
+		rule = _rule(row)
+		with self._lock:
+			old = next((r for rules in self._rules.values() for r in rules if r.rule_id == rule.rule_id), None)
+			self._remove(rule.rule_id)
+			if not row.get("enabled", True):
+				self._state.pop(rule.rule_id, None)
+				return
+			self._rules.setdefault(rule.device_id, []).append(rule)
+			self._state[rule.rule_id] = (self._state.get(rule.rule_id) if _same_series(old, rule) else None) or State()
+			self._dirty.add(rule.rule_id)
+
+	def drop_rule(self, rule_id: int):
+		with self._lock:
+			self._remove(rule_id)
+			self._state.pop(rule_id, None)
+			self._dirty.discard(rule_id)
+
+	def _remove(self, rule_id: int):
+		for device_id, device_rules in list(self._rules.items()):
+			kept = [r for r in device_rules if r.rule_id != rule_id]
+			if kept:
+				self._rules[device_id] = kept
+			else:
+				del self._rules[device_id]
+
+	def evaluate(self, samples, written=None, undo: dict | None = None) -> list:
+		"""Events raised by (device_id, ts_ms, data) samples, restricted to ``written`` keys when given.
+
+		``undo`` (from staged()) collects the states this call changes so they
+		can be put back if the samples are not stored after all.
+		"""
+		if not self._rules:
+			return []
+		keys = set(written) if written is not None else None
+		events = []
+		with self._lock:
+			relevant = [
+				s for s in samples
+				if s[0] in self._rules and (keys is None or (s[0], s[1]) in keys)
+			]
+			# in time order, so rate and zscore see each device's samples as they happened
+			relevant.sort(key=lambda s: s[1])
+			for device_id, ts, data in relevant:
+				for rule in self._rules[device_id]:
+					state = self._state[rule.rule_id]
+					x = _number(data.get(rule.metric))
+					# late and backfilled samples never alert or move the statistics
+					if x is None or (state.last_ts is not None and ts <= state.last_ts):
+						continue
+					if undo is not None and rule.rule_id not in undo:
+						undo[rule.rule_id] = (state, replace(state), None)
+					event = step(rule, state, ts, x)
+					self._dirty.add(rule.rule_id)
+					self.evaluated += 1
+					if event is not None:
+						events.append(event)
+			self.events += len(events)
+			if undo:
+				for rule_id, (state, before, _) in undo.items():
+					undo[rule_id] = (state, before, replace(state))
+		return events
+
+	@contextmanager
+	def staged(self):
+		"""Wraps the transaction that stores samples and their events; pass the
+		yielded dict to evaluate().
+
+		If the block raises (e.g. the commit fails), the rule states evaluate()
+		advanced are restored, so no state counts a sample or an event that was
+		never stored.
+		"""
+		undo: dict = {}
+		try:
+			yield undo
+		except BaseException:
+			self._restore(undo)
+			raise
+
+	def _restore(self, undo: dict):
+		with self._lock:
+			for rule_id, (state, before, after) in undo.items():
+				# a state replaced by put_rule or advanced by another writer since is left alone
+				if self._state.get(rule_id) is state and state == after:
+					self._state[rule_id] = before
+
+	@staticmethod
+	def _event_params(events):
+		return [
+			(e["rule_id"], e["device_id"], e["metric"], e["kind"], e["status"], e["ts"], e["value"], e["score"])
+			for e in events
+		]
+
+	def record(self, cur, events):
+		if events:
+			cur.executemany(EVENT_SQL, self._event_params(events))
+
+	async def record_async(self, cur, events):
+		if events:
+			await cur.executemany(EVENT_SQL, self._event_params(events))
+
+	def _take_dirty(self) -> list:
+		with self._lock:
+			dirty, self._dirty = self._dirty, set()
+			return [
+				(rule_id, s.last_ts, s.last_value, s.n, s.mean, s.m2, s.active, s.last_fired)
+				for rule_id, s in ((r, self._state.get(r)) for r in dirty)
+				if s is not None
+			]
+
+	async def checkpoint(self):
+		rows = self._take_dirty()
+		if not rows:
+			return
+		try:
+			async with get_async_db() as cur:
+				await cur.executemany(CHECKPOINT_SQL, rows)
+		except Exception:
+			with self._lock:
+				self._dirty.update(row[0] for row in rows if row[0] in self._state)
+			raise
+
+	async def _run(self):
+		refreshed = time.monotonic()
+		while True:
+			await asyncio.sleep(CHECKPOINT_S)
+			try:
+				await self.checkpoint()
+				if time.monotonic() - refreshed >= RULES_REFRESH_S:
+					async with get_async_db() as cur:
+						await self.load_async(cur)
+					refreshed = time.monotonic()
+			except Exception:
+				logger.exception("Alert checkpoint failed")
+
+	async def start(self):
+		try:
+			async with get_async_db() as cur:
+				await self.load_async(cur)
+		except Exception:
+			logger.exception("Alert rules unavailable, starting with none")
+		self._task = asyncio.create_task(self._run())
+
+	async def stop(self):
+		task, self._task = self._task, None
+		if task is not None:
+			task.cancel()
+			try:
+				await task
+			except asyncio.CancelledError:
+				pass
+		try:
+			await self.checkpoint()
+		except Exception:
+			logger.exception("Final alert checkpoint failed")
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"rules": sum(len(r) for r in self._rules.values()),
+				"devices": len(self._rules),
+				"evaluated": self.evaluated,
+				"events": self.events,
+				"dirty": len(self._dirty),
+			}
+
+
+engine = AlertEngine()
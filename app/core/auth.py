@@ -1,34 +1,96 @@
 import os
+import time
 import jwt
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Header
 from fastapi.security import OAuth2PasswordBearer
-from app.db.connection import get_db
+from app.db.async_connection import get_async_db
+from app.db.prepared import statement, execute_async
+from app.core.cache import TTLCache, MISSING
+from app.core.instrumentation import phase
+from app.core.device_keys import authenticate_device
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
+# username -> (org_id, role); kept short so role/org changes land quickly
+_principals = TTLCache(
+	maxsize=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+	ttl=float(os.getenv("AUTH_CACHE_TTL", "30")),
+)
+# verified token -> username, valid until the token's exp
+_verified_tokens = TTLCache(
+	maxsize=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000")),
+	ttl=float(os.getenv("AUTH_CACHE_TTL", "30")),
+)
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+PRINCIPAL = statement("auth_principal", "SELECT org_id, role FROM user_master WHERE username=%s;")
+
+
+def _verify_token(token: str) -> str:
+	username = _verified_tokens.get(token)
+	if username is not MISSING:
+		return username
 	secret = os.getenv("TOKEN_SECRET", "dev-secret-change-me")
 	algorithms = [os.getenv("TOKEN_ALGO", "HS256")]
+	payload = jwt.decode(token, secret, algorithms=algorithms)
+	username = payload.get("sub")
+	if not username:
+		raise HTTPException(status_code=401, detail="Invalid token payload")
+	exp = payload.get("exp")
+	_verified_tokens.set(token, username, ttl=None if exp is None else exp - time.time())
+	return username
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+	return await authenticate(token)
+
+
+async def get_ingest_principal(
+	x_device_key: str | None = Header(default=None),
+	token: str | None = Depends(optional_oauth2_scheme),
+):
+	"""A device API key (X-Device-Key) or, failing that, a user bearer token."""
+	if x_device_key:
+		with phase("auth"):
+			return await authenticate_device(x_device_key)
+	if token is None:
+		raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+	return await authenticate(token)
+
+
+async def authenticate(token: str) -> dict:
+	with phase("auth"):
+		return await _authenticate(token)
+
+
+async def _authenticate(token: str) -> dict:
 	try:
-		payload = jwt.decode(token, secret, algorithms=algorithms)
-		username: str | None = payload.get("sub")
-		if not username:
-			raise HTTPException(status_code=401, detail="Invalid token payload")
-		# Always read org_id and role from DB to prevent token org spoofing
-		with get_db() as cur:
-			cur.execute(
-				"SELECT org_id, role FROM user_master WHERE username=%s;",
-				(username,),
-			)
-			row = cur.fetchone()
-			if not row:
-				raise HTTPException(status_code=401, detail="User not found")
-			return {"username": username, "org_id": row["org_id"], "role": row["role"]}
+		username = _verify_token(token)
 	except jwt.ExpiredSignatureError:
 		raise HTTPException(status_code=401, detail="Token expired")
 	except jwt.InvalidTokenError:
 		raise HTTPException(status_code=401, detail="Invalid token")
+	# Always read org_id and role from DB (or the short-lived cache) to prevent token org spoofing
+	principal = _principals.get(username)
+	if principal is MISSING:
+		async with get_async_db() as cur:
+			await execute_async(cur, PRINCIPAL, (username,))
+			row = await cur.fetchone()
+		if not row:
+			raise HTTPException(status_code=401, detail="User not found")
+		principal = (row["org_id"], row["role"])
+		_principals.set(username, principal)
+	org_id, role = principal
+	return {"username": username, "org_id": org_id, "role": role}
+
+
+def invalidate_principal(username: str | None = None):
+	if username is None:
+		_principals.clear()
+	else:
+		_principals.pop(username)
 
 
+def cache_stats() -> dict:
+	return {"principals": _principals.stats(), "tokens": _verified_tokens.stats()}
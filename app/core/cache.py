@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+class TTLCache:
+	"""Bounded LRU mapping whose entries expire ``ttl`` seconds after being set.
+
+	Thread-safe; ``hits``/``misses`` count ``get`` outcomes.
+	"""
+
+	def __init__(self, maxsize: int, ttl: float):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self._data: OrderedDict = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, default=MISSING):
+		with self._lock:
+			entry = self._data.get(key, MISSING)
+			if entry is not MISSING:
+				value, expires_at = entry
+				if expires_at > time.monotonic():
+					self._data.move_to_end(key)
+					self.hits += 1
+					return value
+				del self._data[key]
+			self.misses += 1
+			return default
+
+	def set(self, key, value, ttl: float | None = None):
+		expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+		with self._lock:
+			self._data[key] = (value, expires_at)
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def pop(self, key):
+		with self._lock:
+			self._data.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def stats(self) -> dict:
+		return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+	def __len__(self):
+		return len(self._data)
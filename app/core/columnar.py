@@ -0,0 +1,48 @@
+import json
+from array import array
+from fastapi import HTTPException, Response
+from app.db.telemetry import datetime_to_ms
+from app.core.instrumentation import phase
+
+try:
+	import pyarrow as pa
+except ImportError:  # Arrow output is optional
+	pa = None
+
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+COLUMNAR_JSON = "application/vnd.iot.columnar+json"
+
+
+def negotiate(accept: str | None) -> str | None:
+	"""Columnar media type requested by an Accept header, or None for row JSON."""
+	for part in (accept or "").split(","):
+		media_type = part.split(";")[0].strip().lower()
+		if media_type in (ARROW_STREAM, COLUMNAR_JSON):
+			return media_type
+	return None
+
+
+def columnar_response(media_type: str, names: list, rows: list) -> Response:
+	"""Encode (ts, value, ...) tuples as one timestamp array plus one float64 array per column."""
+	with phase("serialize"):
+		return _encode(media_type, names, rows)
+
+
+def _encode(media_type: str, names: list, rows: list) -> Response:
+	columns = list(zip(*rows)) if rows else [()] * len(names)
+	ts = array("q", map(datetime_to_ms, columns[0]))
+	if media_type == ARROW_STREAM:
+		if pa is None:
+			raise HTTPException(status_code=406, detail="Arrow output requires pyarrow")
+		arrays = [pa.array(ts, type=pa.int64()).cast(pa.timestamp("ms", tz="UTC"))]
+		arrays += [pa.array(col, type=pa.float64()) for col in columns[1:]]
+		batch = pa.RecordBatch.from_arrays(arrays, names=names)
+		sink = pa.BufferOutputStream()
+		with pa.ipc.new_stream(sink, batch.schema) as writer:
+			writer.write_batch(batch)
+		return Response(content=sink.getvalue().to_pybytes(), media_type=ARROW_STREAM)
+	body = {names[0]: ts.tolist()}
+	for name, col in zip(names[1:], columns[1:]):
+		body[name] = list(col)
+	return Response(content=json.dumps(body, separators=(",", ":")), media_type=COLUMNAR_JSON)
@@ -0,0 +1,25 @@
+import os
+from fastapi import Request, Response
+from app.core.serialize import FastJSONResponse
+
+
+# clients always revalidate by default; a 304 costs no database work
+REFERENCE_MAX_AGE = int(os.getenv("REFERENCE_MAX_AGE", "0"))
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+	if not if_none_match:
+		return False
+	if if_none_match.strip() == "*":
+		return True
+	return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def conditional_json(request: Request, etag: str, rows, vary: str | None = None) -> Response:
+	"""JSON body with ETag/Cache-Control, or an empty 304 when If-None-Match already has it."""
+	headers = {"ETag": etag, "Cache-Control": f"private, max-age={REFERENCE_MAX_AGE}, must-revalidate"}
+	if vary:
+		headers["Vary"] = vary
+	if _matches(request.headers.get("if-none-match"), etag):
+		return Response(status_code=304, headers=headers)
+	return FastJSONResponse(content=rows, headers=headers)
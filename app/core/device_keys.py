@@ -0,0 +1,91 @@
+import hashlib
+import hmac
+import os
+import secrets
+from fastapi import HTTPException
+from app.db.async_connection import get_async_db
+from app.core.cache import TTLCache, MISSING
+
+
+# key_id -> (device_id, org_id, secret_hash), or None for unknown/revoked keys
+_keys = TTLCache(
+	maxsize=int(os.getenv("DEVICE_KEY_CACHE_SIZE", "100000")),
+	ttl=float(os.getenv("DEVICE_KEY_CACHE_TTL", "300")),
+)
+NEGATIVE_TTL = float(os.getenv("DEVICE_KEY_NEGATIVE_TTL", "30"))
+
+
+def _digest(secret: str) -> str:
+	# secrets are 256-bit random, so a single SHA-256 is enough (no slow KDF needed)
+	return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def new_key() -> tuple:
+	"""(key_id, full key, secret hash); the full key "<key_id>.<secret>" is shown once."""
+	key_id = secrets.token_urlsafe(9)
+	secret = secrets.token_urlsafe(32)
+	return key_id, f"{key_id}.{secret}", _digest(secret)
+
+
+async def create_key(cur, device_id: str, label: str | None = None) -> dict:
+	key_id, key, secret_hash = new_key()
+	await cur.execute(
+		"""
+		INSERT INTO device_credential (key_id, device_id, secret_hash, label)
+		VALUES (%s, %s, %s, %s)
+		RETURNING key_id, device_id, label, created_at;
+		""",
+		(key_id, device_id, secret_hash, label),
+	)
+	return {**await cur.fetchone(), "key": key}
+
+
+async def revoke_key(cur, device_id: str, key_id: str) -> bool:
+	await cur.execute(
+		"""
+		UPDATE device_credential SET revoked_at = now()
+		WHERE key_id=%s AND device_id=%s AND revoked_at IS NULL;
+		""",
+		(key_id, device_id),
+	)
+	_keys.pop(key_id)
+	return cur.rowcount > 0
+
+
+def invalidate(key_id: str | None = None):
+	if key_id is None:
+		_keys.clear()
+	else:
+		_keys.pop(key_id)
+
+
+async def authenticate_device(key: str) -> dict:
+	"""Principal for an X-Device-Key value; 401 when unknown, revoked or wrong."""
+	key_id, _, secret = key.partition(".")
+	if not key_id or not secret:
+		raise HTTPException(status_code=401, detail="Invalid device key")
+	entry = _keys.get(key_id)
+	if entry is MISSING:
+		async with get_async_db() as cur:
+			await cur.execute(
+				"""
+				SELECT c.device_id, s.org_id, c.secret_hash
+				FROM device_credential c
+				JOIN device_master d ON d.device_id=c.device_id
+				JOIN plant_master p ON d.plant_id=p.plant_id
+				JOIN site_master s ON p.site_id=s.site_id
+				WHERE c.key_id=%s AND c.revoked_at IS NULL;
+				""",
+				(key_id,),
+			)
+			row = await cur.fetchone()
+		entry = (row["device_id"], row["org_id"], row["secret_hash"]) if row else None
+		_keys.set(key_id, entry, ttl=None if entry is not None else NEGATIVE_TTL)
+	if entry is None or not hmac.compare_digest(entry[2], _digest(secret)):
+		raise HTTPException(status_code=401, detail="Invalid device key")
+	device_id, org_id, _ = entry
+	return {"username": None, "org_id": org_id, "role": "device", "device_id": device_id}
+
+
+def stats() -> dict:
+	return _keys.stats()
@@ -0,0 +1,57 @@
+import re
+
+
+_UNITS = {
+	"s": 1, "sec": 1, "secs": 1, "second": 1, "seconds": 1,
+	"m": 60, "min": 60, "mins": 60, "minute": 60, "minutes": 60,
+	"h": 3600, "hr": 3600, "hrs": 3600, "hour": 3600, "hours": 3600,
+	"d": 86400, "day": 86400, "days": 86400,
+	"w": 604800, "week": 604800, "weeks": 604800,
+}
+_INTERVAL_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([a-z]*)\s*$")
+
+
+def parse_interval(value: str) -> float:
+	"""Parse '30s', '5 minutes', '1h', '1d' (bare numbers are seconds) into seconds."""
+	match = _INTERVAL_RE.match(value.lower())
+	if not match or match.group(2) not in _UNITS and match.group(2) != "":
+		raise ValueError(f"Invalid interval: {value}")
+	seconds = float(match.group(1)) * _UNITS.get(match.group(2), 1)
+	if seconds <= 0:
+		raise ValueError(f"Invalid interval: {value}")
+	return seconds
+
+
+def lttb(xs, ys, threshold: int) -> list:
+	"""Largest-Triangle-Three-Buckets: indices of ``threshold`` points that keep the visual shape.
+
+	``ys`` may contain None; those points are never selected.
+	"""
+	points = [i for i, y in enumerate(ys) if y is not None]
+	n = len(points)
+	if threshold >= n:
+		return points
+	if threshold < 3:
+		return [points[0], points[-1]][:threshold]
+
+	selected = [points[0]]
+	every = (n - 2) / (threshold - 2)
+	a = points[0]
+	for i in range(threshold - 2):
+		# average of the next bucket is the third triangle vertex
+		next_start = int((i + 1) * every) + 1
+		next_end = min(int((i + 2) * every) + 1, n)
+		next_bucket = points[next_start:next_end] or points[-1:]
+		avg_x = sum(xs[j] for j in next_bucket) / len(next_bucket)
+		avg_y = sum(ys[j] for j in next_bucket) / len(next_bucket)
+
+		ax, ay = xs[a], ys[a]
+		best, best_area = None, -1.0
+		for j in points[int(i * every) + 1:int((i + 1) * every) + 1]:
+			area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+			if area > best_area:
+				best, best_area = j, area
+		selected.append(best)
+		a = best
+	selected.append(points[-1])
+	return selected
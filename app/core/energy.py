@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+import threading
+from app.db.async_connection import get_async_db
+from app.db.energy import METRIC, apply
+from app.db.telemetry import ms_to_datetime
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH_S = float(os.getenv("ENERGY_FLUSH_S", "30"))
+
+
+class EnergyLedger:
+	"""Tracks which devices got energy readings and folds them into energy_hourly.
+
+	The ingest paths only record the (min, max) timestamp written per device;
+	every ``FLUSH_S`` seconds those ranges are handed to app.db.energy.apply,
+	which appends in-order readings and rebuilds the buckets touched by late
+	ones. Consumption is therefore up to ``FLUSH_S`` seconds behind ingest.
+	"""
+
+	def __init__(self):
+		self._dirty: dict = {}  # device_id -> (min ts_ms, max ts_ms)
+		self._lock = threading.Lock()
+		self._task: asyncio.Task | None = None
+		self.flushes = 0
+		self.failed = 0
+
+	def touch(self, device_id: str, ts_ms: int):
+		with self._lock:
+			lo, hi = self._dirty.get(device_id, (ts_ms, ts_ms))
+			self._dirty[device_id] = (min(lo, ts_ms), max(hi, ts_ms))
+
+	def observe(self, samples, written=None):
+		"""Note (device_id, ts_ms, data) samples carrying a reading, restricted to ``written`` keys when given."""
+		keys = set(written) if written is not None else None
+		for device_id, ts, data in samples:
+			if METRIC in data and (keys is None or (device_id, ts) in keys):
+				self.touch(device_id, ts)
+
+	def _take(self) -> dict:
+		with self._lock:
+			dirty, self._dirty = self._dirty, {}
+		return dirty
+
+	async def flush(self):
+		dirty = self._take()
+		if not dirty:
+			return
+		try:
+			async with get_async_db() as cur:
+				await apply(cur, {d: (ms_to_datetime(lo), ms_to_datetime(hi)) for d, (lo, hi) in dirty.items()})
+		except Exception:
+			# keep the ranges so the next flush retries them
+			with self._lock:
+				for device_id, (lo, hi) in dirty.items():
+					cur_lo, cur_hi = self._dirty.get(device_id, (lo, hi))
+					self._dirty[device_id] = (min(lo, cur_lo), max(hi, cur_hi))
+				self.failed += 1
+			raise
+		self.flushes += 1
+
+	async def _run(self):
+		while True:
+			await asyncio.sleep(FLUSH_S)
+			try:
+				await self.flush()
+			except Exception:
+				logger.exception("Energy ledger flush failed")
+
+	def start(self):
+		self._task = asyncio.create_task(self._run())
+
+	async def stop(self):
+		task, self._task = self._task, None
+		if task is not None:
+			task.cancel()
+			try:
+				await task
+			except asyncio.CancelledError:
+				pass
+		try:
+			await self.flush()
+		except Exception:
+			logger.exception("Final energy ledger flush failed")
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {"pending_devices": len(self._dirty), "flushes": self.flushes, "failed": self.failed}
+
+
+ledger = EnergyLedger()
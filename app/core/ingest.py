@@ -0,0 +1,235 @@
+import logging
+import os
+import queue
+import threading
+import time
+import psycopg2
+from app.db.connection import PoolTimeout, get_db
+from app.db.telemetry import dedupe_samples, insert_samples
+from app.core.latest import store
+from app.core.live import broker
+from app.core.alerts import engine as alerts
+from app.core.energy import ledger
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# worth retrying the same batch: the pool or the server was briefly unavailable
+TRANSIENT_ERRORS = (PoolTimeout, psycopg2.OperationalError, psycopg2.InterfaceError)
+# caused by the rows themselves, e.g. a device deleted since its ownership check
+ROW_ERRORS = (psycopg2.IntegrityError, psycopg2.DataError)
+
+
+class IngestBuffer:
+	"""Write-behind queue for single telemetry samples.
+
+	Producers ``put`` (device_id, ts_ms, data) tuples; one background thread
+	drains the queue and writes a batch once ``flush_rows`` samples are waiting
+	or the oldest one has waited ``flush_interval`` seconds.
+
+	A write failing on a transient error is retried ``retries`` times with
+	exponential backoff from ``backoff`` seconds; one failing on the rows
+	themselves is retried per device so only the bad device's rows are dropped.
+	"""
+
+	def __init__(
+		self,
+		max_depth: int,
+		flush_rows: int,
+		flush_interval: float,
+		policy: str = "skip",
+		retries: int = 3,
+		backoff: float = 0.2,
+	):
+		self.flush_rows = flush_rows
+		self.flush_interval = flush_interval
+		self.policy = policy
+		self.retries = retries
+		self.backoff = backoff
+		self._queue: queue.Queue = queue.Queue(maxsize=max_depth)
+		self._thread: threading.Thread | None = None
+		self._stats_lock = threading.Lock()
+		self.rejected = 0
+		self.flushes = 0
+		self.flushed_rows = 0
+		self.failed_rows = 0
+		self.retried = 0
+		self.last_flush_rows = 0
+		self.last_flush_ms = 0.0
+		self.max_flush_ms = 0.0
+		self.total_flush_ms = 0.0
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run, name="telemetry-ingest", daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout: float):
+		"""Drain the queue and stop, giving up after ``timeout`` seconds (the thread is a daemon)."""
+		if self._thread is None:
+			return
+		deadline = time.monotonic() + timeout
+		try:
+			# waits for room, so everything queued before it is drained
+			self._queue.put(_STOP, timeout=timeout)
+		except queue.Full:
+			logger.warning("Ingest queue still full after %gs, %d samples not flushed", timeout, self._queue.qsize())
+		else:
+			self._thread.join(max(deadline - time.monotonic(), 0))
+			if self._thread.is_alive():
+				logger.warning("Ingest flush still running after %gs, %d samples queued", timeout, self._queue.qsize())
+		self._thread = None
+
+	def put(self, sample) -> bool:
+		if self._thread is None:
+			return False
+		try:
+			self._queue.put_nowait(sample)
+			return True
+		except queue.Full:
+			with self._stats_lock:
+				self.rejected += 1
+			return False
+
+	def _run(self):
+		stopping = False
+		while not stopping:
+			item = self._queue.get()
+			if item is _STOP:
+				break
+			batch = [item]
+			deadline = time.monotonic() + self.flush_interval
+			while len(batch) < self.flush_rows:
+				remaining = deadline - time.monotonic()
+				try:
+					item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+				except queue.Empty:
+					break
+				if item is _STOP:
+					stopping = True
+					break
+				batch.append(item)
+			self._flush(batch)
+		# drain whatever slipped in behind the stop marker
+		rest = []
+		while True:
+			try:
+				item = self._queue.get_nowait()
+			except queue.Empty:
+				break
+			if item is not _STOP:
+				rest.append(item)
+		for i in range(0, len(rest), self.flush_rows):
+			self._flush(rest[i:i + self.flush_rows])
+
+	def _write(self, rows) -> list:
+		# one transaction, retried with backoff while the failure looks transient
+		for attempt in range(self.retries + 1):
+			try:
+				with alerts.staged() as undo, get_db() as cur:
+					written = insert_samples(cur, rows, self.policy)
+					broker.notify(cur, rows, written)
+					alerts.record(cur, alerts.evaluate(rows, written, undo))
+				return written
+			except TRANSIENT_ERRORS:
+				if attempt == self.retries:
+					raise
+				with self._stats_lock:
+					self.retried += 1
+				time.sleep(self.backoff * 2 ** attempt)
+
+	def _write_per_device(self, rows):
+		"""(written, dropped) writing each device's rows in its own transaction."""
+		by_device: dict = {}
+		for row in rows:
+			by_device.setdefault(row[0], []).append(row)
+		written, dropped = [], []
+		for device_id, device_rows in by_device.items():
+			try:
+				written.extend(self._write(device_rows))
+			except Exception:
+				logger.exception("Failed to write %d telemetry samples of device %s", len(device_rows), device_id)
+				dropped.extend(device_rows)
+		return written, dropped
+
+	def _flush(self, batch):
+		started = time.perf_counter()
+		rows, _ = dedupe_samples(batch, self.policy)
+		try:
+			written, dropped = self._write(rows), []
+		except ROW_ERRORS:
+			written, dropped = self._write_per_device(rows)
+		except Exception:
+			logger.exception("Failed to flush %d telemetry samples", len(batch))
+			written, dropped = [], rows
+		for device_id, ts, _ in dropped:
+			logger.error("Dropped telemetry sample device_id=%s ts=%s", device_id, ts)
+		if dropped:
+			with self._stats_lock:
+				self.failed_rows += len(dropped)
+		if len(dropped) == len(rows):
+			return
+		try:
+			store.record_written(rows, written, self.policy)
+			broker.publish(rows, written)
+			ledger.observe(rows, written)
+		except Exception:
+			# the rows are committed; only the in-process views missed them
+			logger.exception("Failed to publish %d flushed telemetry samples", len(written))
+		elapsed_ms = (time.perf_counter() - started) * 1000
+		flushed = len(batch) - len(dropped)
+		with self._stats_lock:
+			self.flushes += 1
+			self.flushed_rows += flushed
+			self.last_flush_rows = flushed
+			self.last_flush_ms = elapsed_ms
+			self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+			self.total_flush_ms += elapsed_ms
+
+	def stats(self) -> dict:
+		with self._stats_lock:
+			return {
+				"queue_depth": self._queue.qsize(),
+				"queue_max": self._queue.maxsize,
+				"rejected": self.rejected,
+				"flushes": self.flushes,
+				"flushed_rows": self.flushed_rows,
+				"failed_rows": self.failed_rows,
+				"retried": self.retried,
+				"last_flush_rows": self.last_flush_rows,
+				"avg_flush_rows": self.flushed_rows / self.flushes if self.flushes else 0,
+				"last_flush_ms": self.last_flush_ms,
+				"avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0,
+				"max_flush_ms": self.max_flush_ms,
+			}
+
+
+_buffer: IngestBuffer | None = None
+
+
+def get_buffer() -> IngestBuffer | None:
+	return _buffer
+
+
+def start_buffer():
+	global _buffer
+	if os.getenv("TELEMETRY_INGEST_MODE", "sync") != "async" or _buffer is not None:
+		return
+	_buffer = IngestBuffer(
+		max_depth=int(os.getenv("TELEMETRY_QUEUE_MAX", "100000")),
+		flush_rows=int(os.getenv("TELEMETRY_FLUSH_ROWS", "5000")),
+		flush_interval=float(os.getenv("TELEMETRY_FLUSH_MS", "250")) / 1000,
+		policy=os.getenv("TELEMETRY_CONFLICT_POLICY", "skip"),
+		retries=int(os.getenv("TELEMETRY_FLUSH_RETRIES", "3")),
+		backoff=float(os.getenv("TELEMETRY_FLUSH_BACKOFF_MS", "200")) / 1000,
+	)
+	_buffer.start()
+
+
+def stop_buffer():
+	# blocking; call it off the event loop
+	global _buffer
+	buffer, _buffer = _buffer, None
+	if buffer is not None:
+		buffer.stop(float(os.getenv("TELEMETRY_STOP_TIMEOUT_S", "30")))
@@ -0,0 +1,191 @@
+import logging
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+
+slow_logger = logging.getLogger("app.db.slow")
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+def _escape(value: str) -> str:
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+	if value == math.inf:
+		return "+Inf"
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+	"""Cumulative-bucket histogram rendered in the Prometheus text format."""
+
+	def __init__(self, name: str, help: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+		self.name = name
+		self.help = help
+		self.labels = labels
+		self.buckets = tuple(buckets) + (math.inf,)
+		self._series: dict = {}  # label values -> [bucket counts..., sum, count]
+		self._lock = threading.Lock()
+
+	def observe(self, label_values: tuple, value: float):
+		with self._lock:
+			series = self._series.get(label_values)
+			if series is None:
+				series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+			for i, bound in enumerate(self.buckets):
+				if value <= bound:
+					series[i] += 1
+					break
+			series[-2] += value
+			series[-1] += 1
+
+	def render(self) -> list:
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+		with self._lock:
+			snapshot = {k: list(v) for k, v in self._series.items()}
+		for label_values, series in sorted(snapshot.items()):
+			base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+			sep = "," if base else ""
+			running = 0
+			for bound, count in zip(self.buckets, series):
+				running += count
+				lines.append(f'{self.name}_bucket{{{base}{sep}le="{_format(bound)}"}} {running}')
+			lines.append(f"{self.name}_sum{{{base}}} {series[-2]}")
+			lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+		return lines
+
+
+REQUEST_SECONDS = Histogram(
+	"http_request_duration_seconds", "Request latency by route template.", ("method", "route", "status"),
+)
+PHASE_SECONDS = Histogram(
+	"app_phase_duration_seconds", "Time spent in request phases such as auth and ownership checks.", ("phase",),
+)
+QUERY_SECONDS = Histogram(
+	"db_query_duration_seconds", "Statement execution time by query name.", ("query",),
+)
+QUERY_ROWS = Histogram(
+	"db_query_rows", "Rows returned or affected per statement.", ("query",), ROW_BUCKETS,
+)
+ACQUIRE_SECONDS = Histogram(
+	"db_pool_acquire_seconds", "Time waiting for a pooled connection.", ("pool",),
+)
+_HISTOGRAMS = (REQUEST_SECONDS, PHASE_SECONDS, QUERY_SECONDS, QUERY_ROWS, ACQUIRE_SECONDS)
+
+
+_NAME_RE = re.compile(
+	r"^\s*(?:/\*.*?\*/\s*)?(?:WITH\b.*?\)\s*)?(SELECT|INSERT\s+INTO|UPDATE|DELETE\s+FROM|CALL|CREATE|ALTER|DROP|LISTEN)\b",
+	re.I | re.S,
+)
+_FROM_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([a-z_][a-z0-9_.]*)", re.I)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def query_name(sql) -> str:
+	"""Low-cardinality label such as 'select telemetry' or 'insert telemetry'."""
+	sql = sql if isinstance(sql, str) else str(sql)
+	match = _NAME_RE.match(sql)
+	verb = match.group(1).split()[0].lower() if match else "other"
+	table = _FROM_RE.search(sql)
+	return f"{verb} {table.group(1).lower()}" if table else verb
+
+
+def normalize_sql(sql) -> str:
+	sql = sql if isinstance(sql, str) else str(sql)
+	sql = _STRING_RE.sub("?", sql)
+	sql = _NUMBER_RE.sub("?", sql)
+	return _SPACE_RE.sub(" ", sql).strip()
+
+
+def params_shape(params) -> list | None:
+	"""Types (and list lengths) of the bind parameters, never their values."""
+	if params is None:
+		return None
+	values = params.values() if isinstance(params, dict) else params
+	shape = []
+	for value in values:
+		if isinstance(value, (list, tuple)):
+			shape.append(f"{type(value).__name__}[{len(value)}]")
+		else:
+			shape.append(type(value).__name__)
+	return shape
+
+
+def record_query(sql, params, seconds: float, rows: int | None):
+	if not ENABLED and SLOW_QUERY_MS <= 0:
+		return
+	name = query_name(sql)
+	if ENABLED:
+		QUERY_SECONDS.observe((name,), seconds)
+		if rows is not None and rows >= 0:
+			QUERY_ROWS.observe((name,), rows)
+	if 0 < SLOW_QUERY_MS <= seconds * 1000:
+		slow_logger.warning(
+			"slow query %.1fms [%s] rows=%s params=%s sql=%s",
+			seconds * 1000, name, rows, params_shape(params), normalize_sql(sql),
+		)
+
+
+def record_acquire(pool: str, seconds: float):
+	if ENABLED:
+		ACQUIRE_SECONDS.observe((pool,), seconds)
+
+
+def record_request(method: str, route: str, status: int, seconds: float):
+	if ENABLED:
+		REQUEST_SECONDS.observe((method, route, str(status)), seconds)
+
+
+@contextmanager
+def phase(name: str):
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		if ENABLED:
+			PHASE_SECONDS.observe((name,), time.perf_counter() - started)
+
+
+def render() -> str:
+	lines = []
+	for histogram in _HISTOGRAMS:
+		lines.extend(histogram.render())
+	return "\n".join(lines) + "\n"
+
+
+class TimingMiddleware:
+	"""ASGI middleware recording every HTTP request by its route template."""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http" or not ENABLED:
+			await self.app(scope, receive, send)
+			return
+		started = time.perf_counter()
+		status = 500
+
+		async def send_wrapper(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_wrapper)
+		finally:
+			route = scope.get("route")
+			record_request(scope["method"], getattr(route, "path", "unmatched"), status, time.perf_counter() - started)
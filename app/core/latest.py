@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from app.db.connection import get_db
+from app.db.prepared import statement, execute_async
+from app.db.replicas import on_replica
+from app.db.telemetry import ms_to_datetime
+
+
+LATEST = statement(
+	"latest_sample",
+	"""
+	SELECT ts, data
+	FROM telemetry
+	WHERE device_id=%s
+	ORDER BY ts DESC
+	LIMIT 1;
+	""",
+)
+
+WARM_SQL = """
+	SELECT d.device_id, t.ts, t.data
+	FROM device_master d
+	CROSS JOIN LATERAL (
+		SELECT ts, data
+		FROM telemetry
+		WHERE device_id=d.device_id
+		ORDER BY ts DESC
+		LIMIT 1
+	) t;
+"""
+
+
+class LatestStore:
+	"""Last known (ts, data) per device, fed by the ingest paths.
+
+	Only writes made by this process are observed, so entries older than
+	``refresh_after`` seconds (0 disables) are re-read from the database.
+	"""
+
+	def __init__(self, refresh_after: float = 0):
+		self.refresh_after = refresh_after
+		self._data: dict = {}  # device_id -> (ts, data, loaded_at)
+		self._lock = threading.Lock()
+
+	def get(self, device_id: str):
+		entry = self._data.get(device_id)
+		if entry is None:
+			return None
+		ts, data, loaded_at = entry
+		if self.refresh_after and time.monotonic() - loaded_at > self.refresh_after:
+			return None
+		return ts, data
+
+	def observe(self, device_id: str, ts, data: dict, merge: bool = False):
+		with self._lock:
+			current = self._data.get(device_id)
+			if current is not None:
+				if ts < current[0]:
+					return
+				if ts == current[0] and merge:
+					data = {**current[1], **data}
+			self._data[device_id] = (ts, data, time.monotonic())
+
+	def replace(self, device_id: str, ts, data: dict):
+		# Only rewrites the entry if it still refers to that exact sample
+		with self._lock:
+			current = self._data.get(device_id)
+			if current is not None and current[0] == ts:
+				self._data[device_id] = (ts, data, time.monotonic())
+
+	def is_latest(self, device_id: str, ts) -> bool:
+		current = self._data.get(device_id)
+		return current is not None and current[0] == ts
+
+	def drop(self, device_id: str):
+		with self._lock:
+			self._data.pop(device_id, None)
+
+	def _loaded(self, device_id: str, row, replica: bool = False):
+		if replica:
+			# a lagging replica may miss samples observe() already has: answer
+			# with the newer of the two and leave the entry to the primary
+			current = self._data.get(device_id)
+			if current is not None and (not row or current[0] > row["ts"]):
+				return current[0], current[1]
+			return (row["ts"], row["data"]) if row else None
+		if not row:
+			self.drop(device_id)
+			return None
+		with self._lock:
+			self._data[device_id] = (row["ts"], row["data"], time.monotonic())
+		return row["ts"], row["data"]
+
+	async def load_async(self, cur, device_id: str):
+		await execute_async(cur, LATEST, (device_id,))
+		return self._loaded(device_id, await cur.fetchone(), on_replica(cur))
+
+	async def fetch_async(self, cur, device_id: str):
+		return self.get(device_id) or await self.load_async(cur, device_id)
+
+	def warm(self, cur):
+		cur.execute(WARM_SQL)
+		now = time.monotonic()
+		rows = cur.fetchall()
+		with self._lock:
+			for row in rows:
+				self._data[row["device_id"]] = (row["ts"], row["data"], now)
+		return len(rows)
+
+	def record_written(self, samples, written, policy: str):
+		"""Feed the newest written sample per device from an insert_samples call."""
+		by_key = {(d, ts): data for d, ts, data in samples}
+		newest: dict = {}
+		for device_id, ts in written:
+			if ts > newest.get(device_id, -1):
+				newest[device_id] = ts
+		for device_id, ts in newest.items():
+			self.observe(device_id, ms_to_datetime(ts), by_key[(device_id, ts)], merge=policy == "merge")
+
+
+store = LatestStore(refresh_after=float(os.getenv("LATEST_REFRESH_S", "0")))
+
+
+def warm_store():
+	if os.getenv("LATEST_WARM", "1") != "1":
+		return
+	with get_db() as cur:
+		store.warm(cur)
+
+
+def as_metrics(data: dict, metrics) -> dict:
+	values = {}
+	for m in metrics:
+		try:
+			values[m] = float(data[m]) if data.get(m) is not None else None
+		except (TypeError, ValueError):
+			values[m] = None
+	return values
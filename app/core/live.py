@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from app.db.async_connection import connect_async, get_async_db
+from app.db.telemetry import ms_to_datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+CHANNEL = "telemetry_live"
+# pg_notify rejects payloads of 8000 bytes or more; bigger samples are announced without data
+NOTIFY_MAX_BYTES = 7900
+
+
+class Subscriber:
+	"""One client's view of the stream.
+
+	Pending samples are keyed by device, so a slow consumer receives only the
+	newest sample per device (``coalesced`` counts the ones it skipped). At most
+	``max_pending`` devices wait at once; beyond that the oldest is dropped.
+	"""
+
+	def __init__(self, devices, max_pending: int):
+		self.devices = frozenset(devices)
+		self.max_pending = max_pending
+		self.coalesced = 0
+		self.dropped = 0
+		self._pending: OrderedDict = OrderedDict()
+		self._ready = asyncio.Event()
+
+	def offer(self, device_id: str, ts_ms: int, data: dict):
+		if device_id in self._pending:
+			self.coalesced += 1
+			self._pending.move_to_end(device_id)
+		elif len(self._pending) >= self.max_pending:
+			self._pending.popitem(last=False)
+			self.dropped += 1
+		self._pending[device_id] = (ts_ms, data)
+		self._ready.set()
+
+	async def next(self, timeout: float | None = None) -> list:
+		"""Wait for pending samples and take them all; [] on timeout."""
+		try:
+			await asyncio.wait_for(self._ready.wait(), timeout)
+		except asyncio.TimeoutError:
+			return []
+		self._ready.clear()
+		pending, self._pending = self._pending, OrderedDict()
+		return [{"device_id": d, "ts": ts, "data": data} for d, (ts, data) in pending.items()]
+
+
+class Broker:
+	"""Per-process fan-out from written samples to live subscribers.
+
+	With the ``local`` backend samples are published by this process's own
+	write paths after commit. With ``notify`` every writer announces samples
+	through pg_notify inside its transaction and each process runs one LISTEN
+	connection, so subscribers see writes from every worker.
+	"""
+
+	def __init__(self, backend: str, max_pending: int, max_subscribers: int):
+		if backend not in ("local", "notify"):
+			raise ValueError(f"Unknown live backend: {backend}")
+		self.backend = backend
+		self.max_pending = max_pending
+		self.max_subscribers = max_subscribers
+		self.published = 0
+		self._by_device: dict = {}
+		self._count = 0
+		self._loop: asyncio.AbstractEventLoop | None = None
+		self._listener: asyncio.Task | None = None
+
+	async def start(self):
+		self._loop = asyncio.get_running_loop()
+		if self.backend == "notify":
+			self._listener = asyncio.create_task(self._listen())
+
+	async def stop(self):
+		if self._listener is not None:
+			self._listener.cancel()
+			try:
+				await self._listener
+			except asyncio.CancelledError:
+				pass
+			self._listener = None
+		self._loop = None
+
+	def subscribe(self, devices) -> Subscriber | None:
+		"""Register a subscriber; None when the process is at max_subscribers."""
+		if self._count >= self.max_subscribers:
+			return None
+		sub = Subscriber(devices, self.max_pending)
+		for device_id in sub.devices:
+			self._by_device.setdefault(device_id, set()).add(sub)
+		self._count += 1
+		return sub
+
+	def unsubscribe(self, sub: Subscriber):
+		for device_id in sub.devices:
+			subs = self._by_device.get(device_id)
+			if subs is not None:
+				subs.discard(sub)
+				if not subs:
+					del self._by_device[device_id]
+		self._count -= 1
+
+	def _dispatch(self, samples):
+		for device_id, ts_ms, data in samples:
+			for sub in self._by_device.get(device_id, ()):
+				sub.offer(device_id, ts_ms, data)
+			self.published += 1
+
+	def publish(self, samples, written=None):
+		"""Hand committed (device_id, ts_ms, data) samples to local subscribers.
+
+		Safe to call from any thread; a no-op with the notify backend (samples
+		come back through the listener instead) or when nobody is subscribed.
+		``written`` limits publishing to the keys an insert actually wrote.
+		"""
+		if self.backend != "local" or not self._by_device or self._loop is None:
+			return
+		if written is not None:
+			keys = set(written)
+			samples = [s for s in samples if (s[0], s[1]) in keys]
+		else:
+			samples = list(samples)
+		if not samples:
+			return
+		try:
+			on_loop = asyncio.get_running_loop() is self._loop
+		except RuntimeError:
+			on_loop = False
+		if on_loop:
+			self._dispatch(samples)
+		else:
+			self._loop.call_soon_threadsafe(self._dispatch, samples)
+
+	def _notify_params(self, samples, written):
+		keys = set(written) if written is not None else None
+		payloads = []
+		for device_id, ts_ms, data in samples:
+			if keys is not None and (device_id, ts_ms) not in keys:
+				continue
+			payload = json.dumps({"d": device_id, "t": ts_ms, "v": data}, separators=(",", ":"))
+			if len(payload.encode()) > NOTIFY_MAX_BYTES:
+				payload = json.dumps({"d": device_id, "t": ts_ms}, separators=(",", ":"))
+			payloads.append(payload)
+		return payloads
+
+	def notify(self, cur, samples, written=None):
+		"""Announce samples via pg_notify; delivered when the caller's transaction commits."""
+		if self.backend != "notify":
+			return
+		payloads = self._notify_params(samples, written)
+		if payloads:
+			cur.execute("SELECT pg_notify(%s, p) FROM unnest(%s::text[]) AS p;", (CHANNEL, payloads))
+
+	async def notify_async(self, cur, samples, written=None):
+		if self.backend != "notify":
+			return
+		payloads = self._notify_params(samples, written)
+		if payloads:
+			await cur.execute("SELECT pg_notify(%s, p) FROM unnest(%s::text[]) AS p;", (CHANNEL, payloads))
+
+	async def _receive(self, payload: str):
+		msg = json.loads(payload)
+		if msg["d"] not in self._by_device:
+			return
+		data = msg.get("v")
+		if data is None:
+			async with get_async_db() as cur:
+				await cur.execute(
+					"SELECT data FROM telemetry WHERE device_id=%s AND ts=%s;",
+					(msg["d"], ms_to_datetime(msg["t"])),
+				)
+				row = await cur.fetchone()
+			if row is None:
+				return
+			data = row["data"]
+		self._dispatch([(msg["d"], msg["t"], data)])
+
+	async def _listen(self):
+		delay = 1.0
+		while True:
+			try:
+				async with await connect_async(autocommit=True) as conn:
+					await conn.execute(f"LISTEN {CHANNEL};")
+					delay = 1.0
+					async for notice in conn.notifies():
+						try:
+							await self._receive(notice.payload)
+						except Exception:
+							logger.exception("Dropping malformed live notification")
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				logger.exception("Live listener disconnected, retrying in %.0fs", delay)
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, 30.0)
+
+	def stats(self) -> dict:
+		return {
+			"backend": self.backend,
+			"subscribers": self._count,
+			"devices": len(self._by_device),
+			"published": self.published,
+		}
+
+
+broker = Broker(
+	backend=os.getenv("LIVE_BACKEND", "local"),
+	max_pending=int(os.getenv("LIVE_CLIENT_BUFFER", "1000")),
+	max_subscribers=int(os.getenv("LIVE_MAX_SUBSCRIBERS", "10000")),
+)
@@ -0,0 +1,101 @@
+import os
+from fastapi import HTTPException
+from app.core.cache import TTLCache, MISSING
+from app.core.instrumentation import phase
+from app.db.prepared import statement, execute_async
+from app.db.replicas import on_replica
+
+
+# device_id -> org_id, or None for devices that do not exist
+_owners = TTLCache(
+	maxsize=int(os.getenv("OWNERSHIP_CACHE_SIZE", "100000")),
+	ttl=float(os.getenv("OWNERSHIP_CACHE_TTL", "300")),
+)
+NEGATIVE_TTL = float(os.getenv("OWNERSHIP_NEGATIVE_TTL", "30"))
+
+OWNERS = statement(
+	"ownership_owners",
+	"""
+	SELECT d.device_id, s.org_id
+	FROM device_master d
+	JOIN plant_master p ON d.plant_id=p.plant_id
+	JOIN site_master s ON p.site_id=s.site_id
+	WHERE d.device_id = ANY(%s)
+	""",
+)
+
+
+def _remember(device_ids, rows, replica: bool = False) -> dict:
+	found = {r["device_id"]: r["org_id"] for r in rows}
+	for device_id in device_ids:
+		org_id = found.get(device_id)
+		if org_id is not None:
+			_owners.set(device_id, org_id)
+		elif not replica:
+			# a lagging replica may not have a new device yet, so only the primary caches "unknown"
+			_owners.set(device_id, None, ttl=NEGATIVE_TTL)
+	return {device_id: found.get(device_id) for device_id in device_ids}
+
+
+def _cached(device_ids):
+	owners = {}
+	missing = []
+	for device_id in set(device_ids):
+		org_id = _owners.get(device_id)
+		if org_id is MISSING:
+			missing.append(device_id)
+		else:
+			owners[device_id] = org_id
+	return owners, missing
+
+
+def _in_org(owners: dict, org_id: str) -> set:
+	return {d for d, owner in owners.items() if owner is not None and owner == org_id}
+
+
+async def device_owners_async(cur, device_ids) -> dict:
+	owners, missing = _cached(device_ids)
+	if missing:
+		await execute_async(cur, OWNERS, (missing,))
+		owners.update(_remember(missing, await cur.fetchall(), on_replica(cur)))
+	return owners
+
+
+async def owned_devices_async(cur, org_id: str, device_ids) -> set:
+	return _in_org(await device_owners_async(cur, device_ids), org_id)
+
+
+async def ensure_device_in_org_async(cur, org_id: str, device_id: str):
+	with phase("ownership"):
+		owned = await owned_devices_async(cur, org_id, [device_id])
+	if device_id not in owned:
+		raise HTTPException(status_code=403, detail="Device not in your organisation")
+
+
+async def scope_devices_async(cur, org_id: str, devices=(), plants=(), sites=()) -> set:
+	"""Devices of the org that are listed directly or sit in one of the given plants/sites."""
+	await cur.execute(
+		"""
+		SELECT d.device_id, s.org_id
+		FROM device_master d
+		JOIN plant_master p ON d.plant_id=p.plant_id
+		JOIN site_master s ON p.site_id=s.site_id
+		WHERE s.org_id=%s AND (d.device_id = ANY(%s) OR d.plant_id = ANY(%s) OR p.site_id = ANY(%s))
+		""",
+		(org_id, list(devices), list(plants), list(sites)),
+	)
+	rows = await cur.fetchall()
+	for row in rows:
+		_owners.set(row["device_id"], row["org_id"])
+	return {row["device_id"] for row in rows}
+
+
+def invalidate(device_id: str | None = None):
+	if device_id is None:
+		_owners.clear()
+	else:
+		_owners.pop(device_id)
+
+
+def stats() -> dict:
+	return _owners.stats()
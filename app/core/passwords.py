@@ -0,0 +1,60 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException
+from passlib.hash import pbkdf2_sha256
+
+
+WORKERS = int(os.getenv("PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# hashes running or queued at once; beyond this logins are shed with 503
+MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", str(WORKERS * 8)))
+
+_pool: ProcessPoolExecutor | None = None
+_pending = 0
+
+
+def _hash(password: str) -> str:
+	return pbkdf2_sha256.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+	return pbkdf2_sha256.verify(password, hashed)
+
+
+def start_password_pool() -> ProcessPoolExecutor:
+	global _pool
+	if _pool is None:
+		# spawn: forking a process that already runs DB pool and ingest threads is unsafe
+		_pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+	return _pool
+
+
+def stop_password_pool():
+	global _pool
+	pool, _pool = _pool, None
+	if pool is not None:
+		pool.shutdown(wait=True, cancel_futures=True)
+
+
+async def _run(fn, *args):
+	global _pending
+	if _pending >= MAX_PENDING:
+		raise HTTPException(status_code=503, detail="Authentication busy, retry later", headers={"Retry-After": "1"})
+	_pending += 1
+	try:
+		return await asyncio.get_running_loop().run_in_executor(_pool or start_password_pool(), fn, *args)
+	finally:
+		_pending -= 1
+
+
+async def hash_password(password: str) -> str:
+	return await _run(_hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+	return await _run(_verify, password, hashed)
+
+
+def stats() -> dict:
+	return {"workers": WORKERS, "pending": _pending, "max_pending": MAX_PENDING}
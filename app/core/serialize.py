@@ -0,0 +1,72 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+from fastapi import Response
+from app.core.instrumentation import phase
+
+try:
+	import orjson
+except ImportError:  # falls back to the stdlib encoder
+	orjson = None
+
+
+def _default(value):
+	# the types jsonable_encoder would have converted, with the same output
+	if isinstance(value, Decimal):
+		return int(value) if value.as_tuple().exponent >= 0 else float(value)
+	if isinstance(value, (datetime, date, time)):
+		return value.isoformat()
+	if isinstance(value, UUID):
+		return str(value)
+	if isinstance(value, (set, frozenset)):
+		return list(value)
+	raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+	def dumps(value) -> bytes:
+		return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+	loads = orjson.loads
+else:
+	def dumps(value) -> bytes:
+		return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+	loads = json.loads
+
+
+class FastJSONResponse(Response):
+	"""JSON response for content that is already plain data; skips jsonable_encoder."""
+
+	media_type = "application/json"
+
+	def render(self, content) -> bytes:
+		with phase("serialize"):
+			return dumps(content)
+
+
+def rows_response(names: list, rows, raw: tuple = (), headers: dict | None = None) -> Response:
+	"""JSON array of objects from tuple rows, the same document as the dict-row output.
+
+	Columns named in ``raw`` must hold JSON text (e.g. ``data::text``); it is
+	spliced into the body as is instead of being parsed and re-encoded, so it
+	keeps Postgres' spacing.
+	"""
+	with phase("serialize"):
+		raw_at = {i for i, name in enumerate(names) if name in raw}
+		if not raw_at:
+			body = dumps([dict(zip(names, row)) for row in rows])
+		else:
+			keys = [dumps(name) + b":" for name in names]
+			parts = []
+			for row in rows:
+				fields = []
+				for i, value in enumerate(row):
+					if i in raw_at:
+						fields.append(keys[i] + (value.encode() if value is not None else b"null"))
+					else:
+						fields.append(keys[i] + dumps(value))
+				parts.append(b"{" + b",".join(fields) + b"}")
+			body = b"[" + b",".join(parts) + b"]"
+	return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row, tuple_row
+from psycopg.types.json import set_json_loads
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from app.core.instrumentation import record_acquire, record_query
+from app.core.serialize import loads
+from app.db.replicas import ACQUIRE_TIMEOUT_S, CHECK_S, LAG_SQL, RECEIVER_TIMEOUT_S, replicas
+
+
+# JSONB still parsed into dicts (latest store, RETURNING data) goes through orjson when installed
+set_json_loads(loads)
+
+
+logger = logging.getLogger(__name__)
+
+_pool: AsyncConnectionPool | None = None
+_replica_pools: dict = {}  # host -> AsyncConnectionPool
+_checker: asyncio.Task | None = None
+
+
+class TimedAsyncCursor(psycopg.AsyncCursor):
+	"""AsyncCursor that reports each statement's duration and row count."""
+
+	async def execute(self, query, params=None, **kwargs):
+		started = time.perf_counter()
+		try:
+			return await super().execute(query, params, **kwargs)
+		finally:
+			record_query(query, params, time.perf_counter() - started, self.rowcount)
+
+
+def _conninfo(host: str | None = None) -> str:
+	return make_conninfo(
+		host=host or os.getenv("DB_HOST", "localhost"),
+		dbname=os.getenv("DB_NAME"),
+		user=os.getenv("DB_USER"),
+		password=os.getenv("DB_PASSWORD"),
+	)
+
+
+async def connect_async(**kwargs) -> psycopg.AsyncConnection:
+	# standalone connection outside the pool, e.g. for a long-lived LISTEN
+	return await psycopg.AsyncConnection.connect(_conninfo(), **kwargs)
+
+
+def _new_pool(conninfo: str, min_size: int) -> AsyncConnectionPool:
+	return AsyncConnectionPool(
+		conninfo,
+		min_size=min_size,
+		max_size=int(os.getenv("DB_POOL_MAX", "20")),
+		max_idle=float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300")),
+		timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+		check=AsyncConnectionPool.check_connection,
+		kwargs={"row_factory": dict_row, "cursor_factory": TimedAsyncCursor},
+		open=False,
+	)
+
+
+async def open_async_pool() -> AsyncConnectionPool:
+	global _pool, _checker
+	if _pool is None:
+		pool = _new_pool(_conninfo(), int(os.getenv("DB_POOL_MIN", "1")))
+		await pool.open()
+		_pool = pool
+		for replica in replicas.replicas:
+			replica_pool = _new_pool(_conninfo(replica.host), 0)
+			# wait=False: a replica that is down must not block startup
+			await replica_pool.open(wait=False)
+			_replica_pools[replica.host] = replica_pool
+		if _replica_pools:
+			await check_replicas()
+			_checker = asyncio.create_task(_check_loop())
+	return _pool
+
+
+async def close_async_pool():
+	global _pool, _checker
+	checker, _checker = _checker, None
+	if checker is not None:
+		checker.cancel()
+		try:
+			await checker
+		except asyncio.CancelledError:
+			pass
+	pool, _pool = _pool, None
+	others = list(_replica_pools.values())
+	_replica_pools.clear()
+	for p in [pool, *others]:
+		if p is not None:
+			await p.close()
+
+
+async def _check(replica):
+	try:
+		async with _replica_pools[replica.host].connection(timeout=ACQUIRE_TIMEOUT_S) as conn:
+			cur = await conn.execute(LAG_SQL, (RECEIVER_TIMEOUT_S,))
+			lag = (await cur.fetchone())["lag"]
+	except Exception:
+		lag = None
+	replicas.record_check(replica, lag)
+
+
+async def check_replicas():
+	"""Refresh health and replay lag of every replica; shared by the sync and async paths."""
+	await asyncio.gather(*(_check(r) for r in replicas.replicas))
+
+
+async def _check_loop():
+	while True:
+		await asyncio.sleep(CHECK_S)
+		try:
+			await check_replicas()
+		except Exception:
+			logger.exception("Replica health check failed")
+
+
+async def _connection(stack: AsyncExitStack, readonly: bool):
+	# read-only work goes to a healthy replica when there is one, the primary otherwise
+	started = time.perf_counter()
+	replica = replicas.pick() if readonly else None
+	if replica is not None:
+		try:
+			conn = await stack.enter_async_context(_replica_pools[replica.host].connection(timeout=ACQUIRE_TIMEOUT_S))
+		except (PoolTimeout, KeyError):
+			replicas.failed(replica)
+		else:
+			stack.callback(replicas.release, replica)
+			record_acquire("async_replica", time.perf_counter() - started)
+			return conn, replica
+	pool = _pool or await open_async_pool()
+	conn = await stack.enter_async_context(pool.connection())
+	record_acquire("async", time.perf_counter() - started)
+	return conn, None
+
+
+@asynccontextmanager
+async def get_async_db(readonly: bool = False):
+	# the pool commits on a clean exit and rolls back when the block raises;
+	# readonly=True may be served by a replica within DB_REPLICA_MAX_LAG_S
+	async with AsyncExitStack() as stack:
+		conn, replica = await _connection(stack, readonly)
+		async with conn.cursor() as cur:
+			cur.replica = replica.host if replica is not None else None
+			yield cur
+
+
+@asynccontextmanager
+async def get_async_stream_cursor(itersize: int = 2000, readonly: bool = False):
+	# Named (server-side) cursor yielding tuples, pulled ``itersize`` rows at a time
+	async with AsyncExitStack() as stack:
+		conn, replica = await _connection(stack, readonly)
+		async with conn.cursor(name=f"stream_{uuid.uuid4().hex}", row_factory=tuple_row) as cur:
+			cur.itersize = itersize
+			yield cur
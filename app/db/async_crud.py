@@ -0,0 +1,59 @@
+from app.db.async_connection import get_async_db
+from app.db.crud import invalidate_reference, lookup_reference, reference_generation, remember_reference
+from app.core.cache import MISSING
+
+
+async def create_record(table: str, data: dict):
+	async with get_async_db() as cur:
+		cols = ', '.join(data.keys())
+		vals = ', '.join(['%s'] * len(data))
+		await cur.execute(
+			f"INSERT INTO {table} ({cols}) VALUES ({vals}) RETURNING *;",
+			tuple(data.values()),
+		)
+		row = await cur.fetchone()
+	invalidate_reference()
+	return row
+
+
+async def get_all(table: str):
+	async with get_async_db() as cur:
+		await cur.execute(f"SELECT * FROM {table};")
+		return await cur.fetchall()
+
+
+async def cached_query(key, sql: str, params=()):
+	"""(etag, rows) of a read-only reference query, cached until the next crud write."""
+	entry = lookup_reference(key)
+	if entry is not MISSING:
+		return entry
+	generation = reference_generation()
+	async with get_async_db() as cur:
+		await cur.execute(sql, params)
+		rows = await cur.fetchall()
+	return remember_reference(key, rows, generation)
+
+
+async def get_by_id(table: str, key: str, value):
+	async with get_async_db() as cur:
+		await cur.execute(f"SELECT * FROM {table} WHERE {key}=%s;", (value,))
+		return await cur.fetchone()
+
+
+async def delete_by_id(table: str, key: str, value):
+	async with get_async_db() as cur:
+		await cur.execute(f"DELETE FROM {table} WHERE {key}=%s;", (value,))
+	invalidate_reference()
+
+
+async def update_by_id(table: str, key: str, value, data: dict):
+	async with get_async_db() as cur:
+		set_clause = ', '.join([f"{k}=%s" for k in data.keys()])
+		params = list(data.values()) + [value]
+		await cur.execute(
+			f"UPDATE {table} SET {set_clause} WHERE {key}=%s RETURNING *;",
+			tuple(params),
+		)
+		row = await cur.fetchone()
+	invalidate_reference()
+	return row
@@ -1,30 +1,254 @@
 import os
+import threading
+import time
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
+from app.core.instrumentation import record_acquire, record_query
+from app.db.replicas import ACQUIRE_TIMEOUT_S, replicas
 
 
-def _get_connection():
+class PoolTimeout(Exception):
+	pass
+
+
+class TimedCursor(RealDictCursor):
+	"""RealDictCursor that reports each statement's duration and row count."""
+
+	def execute(self, query, vars=None):
+		started = time.perf_counter()
+		try:
+			return super().execute(query, vars)
+		finally:
+			record_query(query, vars, time.perf_counter() - started, self.rowcount)
+
+
+def _get_connection(host: str | None = None):
 	return psycopg2.connect(
-		host=os.getenv("DB_HOST", "localhost"),
+		host=host or os.getenv("DB_HOST", "localhost"),
 		dbname=os.getenv("DB_NAME"),
 		user=os.getenv("DB_USER"),
 		password=os.getenv("DB_PASSWORD"),
 	)
 
 
+class ConnectionPool:
+	"""Thread-safe pool of psycopg2 connections.
+
+	Idle connections are handed out LIFO so the hot ones stay warm and the
+	cold tail ages out after ``idle_timeout`` seconds (never below ``minconn``).
+	A connection that has been idle longer than ``check_after`` seconds is
+	pinged before reuse; broken ones are replaced transparently.
+	"""
+
+	def __init__(
+		self,
+		minconn: int,
+		maxconn: int,
+		idle_timeout: float,
+		acquire_timeout: float,
+		check_after: float = 5.0,
+		connect=_get_connection,
+	):
+		if maxconn < 1 or minconn < 0 or minconn > maxconn:
+			raise ValueError("Invalid pool size")
+		self.minconn = minconn
+		self.maxconn = maxconn
+		self.idle_timeout = idle_timeout
+		self.acquire_timeout = acquire_timeout
+		self.check_after = check_after
+		self._connect = connect
+		self._idle: list = []  # [(conn, released_at)]
+		self._size = 0
+		self._closed = False
+		self._cond = threading.Condition()
+		for _ in range(minconn):
+			self._idle.append((self._connect(), time.monotonic()))
+			self._size += 1
+
+	def _healthy(self, conn, idle_for: float) -> bool:
+		if conn.closed:
+			return False
+		if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+			return False
+		if idle_for < self.check_after:
+			return True
+		try:
+			with conn.cursor() as cur:
+				cur.execute("SELECT 1;")
+			conn.rollback()
+			return True
+		except psycopg2.Error:
+			return False
+
+	def _discard(self, conn):
+		try:
+			conn.close()
+		except psycopg2.Error:
+			pass
+
+	def _reap_idle(self, now: float):
+		# caller holds the lock; oldest idle connections sit at the front
+		while self._size > self.minconn and self._idle and now - self._idle[0][1] > self.idle_timeout:
+			conn, _ = self._idle.pop(0)
+			self._size -= 1
+			self._discard(conn)
+
+	def getconn(self):
+		deadline = time.monotonic() + self.acquire_timeout
+		while True:
+			with self._cond:
+				while True:
+					if self._closed:
+						raise PoolTimeout("Connection pool is closed")
+					now = time.monotonic()
+					self._reap_idle(now)
+					if self._idle:
+						conn, released_at = self._idle.pop()
+						break
+					if self._size < self.maxconn:
+						self._size += 1
+						conn, released_at = None, now
+						break
+					remaining = deadline - now
+					if remaining <= 0:
+						raise PoolTimeout(f"Timed out after {self.acquire_timeout}s waiting for a database connection")
+					self._cond.wait(remaining)
+
+			if conn is None:
+				try:
+					return self._connect()
+				except Exception:
+					with self._cond:
+						self._size -= 1
+						self._cond.notify()
+					raise
+
+			if self._healthy(conn, time.monotonic() - released_at):
+				return conn
+			self._discard(conn)
+			with self._cond:
+				self._size -= 1
+				self._cond.notify()
+
+	def putconn(self, conn, broken: bool = False):
+		if not broken and not conn.closed:
+			try:
+				if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+					conn.rollback()
+			except psycopg2.Error:
+				broken = True
+		with self._cond:
+			if broken or conn.closed or self._closed:
+				self._size -= 1
+				self._discard(conn)
+			else:
+				self._idle.append((conn, time.monotonic()))
+			self._cond.notify()
+
+	def close(self):
+		with self._cond:
+			self._closed = True
+			idle, self._idle = self._idle, []
+			self._size -= len(idle)
+			self._cond.notify_all()
+		for conn, _ in idle:
+			self._discard(conn)
+
+
+_pool: ConnectionPool | None = None
+_replica_pools: dict = {}  # host -> ConnectionPool
+_pool_lock = threading.Lock()
+
+
+def open_pool() -> ConnectionPool:
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			_pool = ConnectionPool(
+				minconn=int(os.getenv("DB_POOL_MIN", "1")),
+				maxconn=int(os.getenv("DB_POOL_MAX", "20")),
+				idle_timeout=float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300")),
+				acquire_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+			)
+		return _pool
+
+
+def _replica_pool(host: str) -> ConnectionPool:
+	pool = _replica_pools.get(host)
+	if pool is None:
+		with _pool_lock:
+			pool = _replica_pools.get(host)
+			if pool is None:
+				# no eager connections: a replica that is down must not block startup
+				pool = _replica_pools[host] = ConnectionPool(
+					minconn=0,
+					maxconn=int(os.getenv("DB_POOL_MAX", "20")),
+					idle_timeout=float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300")),
+					acquire_timeout=ACQUIRE_TIMEOUT_S,
+					connect=lambda: _get_connection(host),
+				)
+	return pool
+
+
+def close_pool():
+	global _pool
+	with _pool_lock:
+		pool, _pool = _pool, None
+		others = list(_replica_pools.values())
+		_replica_pools.clear()
+	for p in [pool, *others]:
+		if p is not None:
+			p.close()
+
+
+def _acquire(readonly: bool):
+	"""(pool, conn, replica) for the work; read-only work goes to a healthy replica when there is one."""
+	replica = replicas.pick() if readonly else None
+	if replica is not None:
+		pool = _replica_pool(replica.host)
+		try:
+			return pool, pool.getconn(), replica
+		except (psycopg2.OperationalError, PoolTimeout):
+			replicas.failed(replica)
+	pool = _pool or open_pool()
+	return pool, pool.getconn(), None
+
+
 @contextmanager
-def get_db():
-	conn = _get_connection()
-	cur = conn.cursor(cursor_factory=RealDictCursor)
+def get_db(readonly: bool = False):
+	"""Transaction-scoped cursor; ``readonly=True`` may be served by a replica within DB_REPLICA_MAX_LAG_S."""
+	started = time.perf_counter()
+	pool, conn, replica = _acquire(readonly)
+	record_acquire("sync" if replica is None else "sync_replica", time.perf_counter() - started)
+	broken = False
+	cur = conn.cursor(cursor_factory=TimedCursor)
+	cur.replica = replica.host if replica is not None else None
 	try:
 		yield cur
 		conn.commit()
 	except Exception:
-		conn.rollback()
+		try:
+			conn.rollback()
+		except psycopg2.Error:
+			broken = True
 		raise
 	finally:
 		cur.close()
-		conn.close()
+		pool.putconn(conn, broken=broken or bool(conn.closed))
+		if replica is not None:
+			replicas.release(replica)
 
 
+@contextmanager
+def get_autocommit_db():
+	# DDL such as continuous aggregate creation/refresh cannot run inside a transaction
+	conn = _get_connection()
+	conn.autocommit = True
+	cur = conn.cursor(cursor_factory=TimedCursor)
+	try:
+		yield cur
+	finally:
+		cur.close()
+		conn.close()
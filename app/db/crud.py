@@ -1,4 +1,45 @@
+import hashlib
+import json
+import os
+import threading
 from app.db.connection import get_db
+from app.core.cache import TTLCache, MISSING
+
+
+# (query key) -> (etag, rows) for rarely written master data. Any write through
+# this module (or async_crud) drops the whole cache; other workers catch up
+# within REFERENCE_CACHE_TTL.
+_reference = TTLCache(
+	maxsize=int(os.getenv("REFERENCE_CACHE_SIZE", "1000")),
+	ttl=float(os.getenv("REFERENCE_CACHE_TTL", "60")),
+)
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def reference_generation() -> int:
+	return _generation
+
+
+def invalidate_reference():
+	global _generation
+	with _generation_lock:
+		_generation += 1
+		_reference.clear()
+
+
+def lookup_reference(key):
+	return _reference.get(key)
+
+
+def remember_reference(key, rows, generation: int):
+	"""Cache rows loaded under ``generation``; a write since then skips the cache."""
+	digest = hashlib.sha256(json.dumps(rows, sort_keys=True, default=str).encode()).hexdigest()
+	entry = (f'"{digest[:32]}"', rows)
+	with _generation_lock:
+		if generation == _generation:
+			_reference.set(key, entry)
+	return entry
 
 
 def create_record(table: str, data: dict):
@@ -9,7 +50,9 @@ def create_record(table: str, data: dict):
 			f"INSERT INTO {table} ({cols}) VALUES ({vals}) RETURNING *;",
 			tuple(data.values()),
 		)
-		return cur.fetchone()
+		row = cur.fetchone()
+	invalidate_reference()
+	return row
 
 
 def get_all(table: str):
@@ -18,6 +61,15 @@ def get_all(table: str):
 		return cur.fetchall()
 
 
+def get_all_cached(table: str):
+	"""(etag, rows) of get_all, served from the reference cache when possible."""
+	entry = lookup_reference(table)
+	if entry is not MISSING:
+		return entry
+	generation = reference_generation()
+	return remember_reference(table, get_all(table), generation)
+
+
 def get_by_id(table: str, key: str, value):
 	with get_db() as cur:
 		cur.execute(f"SELECT * FROM {table} WHERE {key}=%s;", (value,))
@@ -27,6 +79,7 @@ def get_by_id(table: str, key: str, value):
 def delete_by_id(table: str, key: str, value):
 	with get_db() as cur:
 		cur.execute(f"DELETE FROM {table} WHERE {key}=%s;", (value,))
+	invalidate_reference()
 
 
 def update_by_id(table: str, key: str, value, data: dict):
@@ -37,6 +90,8 @@ def update_by_id(table: str, key: str, value, data: dict):
 			f"UPDATE {table} SET {set_clause} WHERE {key}=%s RETURNING *;",
 			tuple(params),
 		)
-		return cur.fetchone()
+		row = cur.fetchone()
+	invalidate_reference()
+	return row
 
 
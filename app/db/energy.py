@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from app.db.async_connection import get_async_db
+from app.db.metric_registry import metric_expr
+from app.db.telemetry import EPOCH
+
+
+logger = logging.getLogger(__name__)
+
+METRIC = "energy_kwh"
+BUCKET = timedelta(hours=1)
+# a drop smaller than this fraction of the previous reading is meter jitter, not a reset
+RESET_RATIO = float(os.getenv("ENERGY_RESET_RATIO", "0.1"))
+
+# serializes ledger writers across workers; everything is derived from raw telemetry
+LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('energy_hourly'));"
+
+HEADS_SQL = """
+	SELECT DISTINCT ON (device_id) device_id, last_ts, last_kwh
+	FROM energy_hourly
+	WHERE device_id = ANY(%s)
+	ORDER BY device_id, bucket DESC;
+"""
+
+
+def bucket_floor(ts: datetime) -> datetime:
+	return EPOCH + (ts - EPOCH) // BUCKET * BUCKET
+
+
+def _fold_sql(scope_sql: str, samples_sql: str, lower: str) -> str:
+	"""Per-hour consumption of ``samples`` (device_id, ts, kwh) for the devices in
+	``scope``, counting only rows matching ``lower``.
+
+	Each reading contributes its rise over the previous one to the bucket it
+	falls in; a drop is a counter reset, after which the new reading itself is
+	the consumption since the reset.
+	"""
+	reset = f"prev IS NOT NULL AND kwh < prev * (1 - {RESET_RATIO})"
+	return f"""
+		WITH scope AS ({scope_sql}),
+		samples AS ({samples_sql}),
+		deltas AS (
+			SELECT device_id, ts, kwh, lag(kwh) OVER (PARTITION BY device_id ORDER BY ts) AS prev
+			FROM samples
+		)
+		SELECT d.device_id, time_bucket(INTERVAL '1 hour', d.ts) AS bucket,
+			min(d.ts) AS first_ts, max(d.ts) AS last_ts, last(d.kwh, d.ts) AS last_kwh,
+			sum(CASE WHEN {reset} THEN kwh WHEN kwh > prev THEN kwh - prev ELSE 0 END) AS consumption,
+			count(*) FILTER (WHERE {reset}) AS resets,
+			count(*) AS samples
+		FROM deltas d
+		JOIN scope s ON s.device_id = d.device_id
+		WHERE {lower}
+		GROUP BY 1, 2
+	"""
+
+
+def _append_sql() -> str:
+	expr = metric_expr(METRIC)
+	folded = _fold_sql(
+		"SELECT * FROM unnest(%s::text[], %s::timestamptz[], %s::float8[]) AS s(device_id, after, seed)",
+		f"""
+		SELECT s.device_id, t.ts, {expr} AS kwh
+		FROM scope s JOIN telemetry t ON t.device_id = s.device_id AND t.ts > s.after
+		WHERE {expr} IS NOT NULL
+		UNION ALL
+		SELECT device_id, after, seed FROM scope
+		""",
+		"d.ts > s.after",
+	)
+	return f"""
+		INSERT INTO energy_hourly (device_id, bucket, first_ts, last_ts, last_kwh, consumption, resets, samples)
+		{folded}
+		ON CONFLICT (device_id, bucket) DO UPDATE SET
+			last_ts = EXCLUDED.last_ts,
+			last_kwh = EXCLUDED.last_kwh,
+			consumption = energy_hourly.consumption + EXCLUDED.consumption,
+			resets = energy_hourly.resets + EXCLUDED.resets,
+			samples = energy_hourly.samples + EXCLUDED.samples,
+			updated_at = now();
+	"""
+
+
+def _recompute_sql() -> str:
+	expr = metric_expr(METRIC)
+	folded = _fold_sql(
+		"SELECT * FROM unnest(%s::text[], %s::timestamptz[], %s::timestamptz[]) AS s(device_id, start, stop)",
+		f"""
+		SELECT s.device_id, t.ts, {expr} AS kwh
+		FROM scope s JOIN telemetry t ON t.device_id = s.device_id AND t.ts >= s.start AND t.ts < s.stop
+		WHERE {expr} IS NOT NULL
+		UNION ALL
+		SELECT s.device_id, p.ts, p.kwh
+		FROM scope s CROSS JOIN LATERAL (
+			SELECT t.ts, {expr} AS kwh
+			FROM telemetry t
+			WHERE t.device_id = s.device_id AND t.ts < s.start AND {expr} IS NOT NULL
+			ORDER BY t.ts DESC
+			LIMIT 1
+		) p
+		""",
+		"d.ts >= s.start",
+	)
+	return f"""
+		INSERT INTO energy_hourly (device_id, bucket, first_ts, last_ts, last_kwh, consumption, resets, samples)
+		{folded}
+		ON CONFLICT (device_id, bucket) DO UPDATE SET
+			first_ts = EXCLUDED.first_ts,
+			last_ts = EXCLUDED.last_ts,
+			last_kwh = EXCLUDED.last_kwh,
+			consumption = EXCLUDED.consumption,
+			resets = EXCLUDED.resets,
+			samples = EXCLUDED.samples,
+			updated_at = now();
+	"""
+
+
+def _extent_sql() -> str:
+	# a changed bucket also changes the first delta of the next bucket holding a reading
+	expr = metric_expr(METRIC)
+	return f"""
+		SELECT s.device_id, s.start, COALESCE(time_bucket(INTERVAL '1 hour', n.ts) + INTERVAL '1 hour', s.until) AS stop
+		FROM unnest(%s::text[], %s::timestamptz[], %s::timestamptz[]) AS s(device_id, start, until)
+		LEFT JOIN LATERAL (
+			SELECT t.ts
+			FROM telemetry t
+			WHERE t.device_id = s.device_id AND t.ts >= s.until AND {expr} IS NOT NULL
+			ORDER BY t.ts
+			LIMIT 1
+		) n ON true;
+	"""
+
+
+async def recompute(cur, ranges):
+	"""Rebuild the buckets covering (device_id, start, until) ranges from raw telemetry."""
+	if not ranges:
+		return
+	await cur.execute(_extent_sql(), [list(col) for col in zip(*ranges)])
+	scope = [(r["device_id"], r["start"], r["stop"]) for r in await cur.fetchall()]
+	params = [list(col) for col in zip(*scope)]
+	# buckets whose readings were all deleted must go too
+	await cur.execute(
+		"""
+		DELETE FROM energy_hourly e
+		USING unnest(%s::text[], %s::timestamptz[], %s::timestamptz[]) AS s(device_id, start, stop)
+		WHERE e.device_id = s.device_id AND e.bucket >= s.start AND e.bucket < s.stop;
+		""",
+		params,
+	)
+	await cur.execute(_recompute_sql(), params)
+
+
+async def apply(cur, dirty: dict):
+	"""Fold new readings into the ledger; ``dirty`` maps device_id -> (min_ts, max_ts) written since the last call.
+
+	Devices whose new readings are all past the ledger head are appended to
+	from the head's last reading; anything older (late, out-of-order, updated
+	or deleted samples) rebuilds only the buckets it touches.
+	"""
+	await cur.execute(LOCK_SQL)
+	await cur.execute(HEADS_SQL, (list(dirty),))
+	heads = {r["device_id"]: (r["last_ts"], r["last_kwh"]) for r in await cur.fetchall()}
+	append, ranges = [], []
+	for device_id, (lo, hi) in dirty.items():
+		head = heads.get(device_id)
+		if head is not None and lo > head[0]:
+			append.append((device_id, head[0], head[1]))
+		else:
+			ranges.append((device_id, bucket_floor(lo), bucket_floor(hi) + BUCKET))
+	if append:
+		await cur.execute(_append_sql(), [list(col) for col in zip(*append)])
+	await recompute(cur, ranges)
+
+
+async def backfill(device_ids=None):
+	"""Rebuild the whole ledger (or some devices) from telemetry, one device per transaction.
+
+	Returns the devices rebuilt.
+	"""
+	async with get_async_db() as cur:
+		if device_ids:
+			devices = list(device_ids)
+		else:
+			await cur.execute("SELECT device_id FROM device_master ORDER BY device_id;")
+			devices = [r["device_id"] for r in await cur.fetchall()]
+	until = bucket_floor(datetime.now(tz=timezone.utc)) + BUCKET
+	for device_id in devices:
+		async with get_async_db() as cur:
+			await cur.execute(LOCK_SQL)
+			await recompute(cur, [(device_id, EPOCH, until)])
+		logger.info("Rebuilt the energy ledger of %s", device_id)
+	return devices
+
+
+if __name__ == "__main__":
+	from app.db.metric_registry import init_registry
+
+	logging.basicConfig(level=logging.INFO)
+	if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+		sys.exit("usage: python -m app.db.energy backfill [device_id ...]")
+	init_registry()
+	devices = asyncio.run(backfill(sys.argv[2:]))
+	print(f"Rebuilt {len(devices)} devices")
@@ -0,0 +1,191 @@
+import logging
+import os
+import re
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from app.db.connection import get_db, get_autocommit_db
+
+
+logger = logging.getLogger(__name__)
+
+
+# Seed set, used until the registry table has been loaded (or when it does not exist)
+DEFAULT_METRICS = [
+	"thd_v_r",
+	"pf_total",
+	"frequency",
+	"energy_kwh",
+	"current_avg",
+	"voltage_ll_avg",
+	"active_power_total",
+]
+
+# metric names are spliced into SQL as JSONB keys and column suffixes
+_NAME_RE = re.compile(r"^[a-z][a-z0-9_]{0,50}$")
+
+
+@dataclass(frozen=True)
+class Metric:
+	name: str
+	promoted: bool = False
+	backfilled: bool = False
+
+	@property
+	def column(self) -> str:
+		return f"m_{self.name}"
+
+
+# metric name -> Metric, filled by load_registry()
+_registry: dict = {m: Metric(m) for m in DEFAULT_METRICS}
+
+
+def _check_name(name: str) -> str:
+	if not _NAME_RE.match(name):
+		raise ValueError(f"Invalid metric name: {name}")
+	return name
+
+
+def _json_expr(name: str, prefix: str = "") -> str:
+	return f"({prefix}data->>'{name}')::double precision"
+
+
+def allowed_metrics() -> frozenset:
+	return frozenset(_registry)
+
+
+def invalid_metrics(metrics) -> list:
+	return [m for m in metrics if m not in _registry]
+
+
+def metric_expr(name: str) -> str:
+	"""SQL for a metric's value: the typed column once backfilled, the column
+	with a JSONB fallback while the backfill runs, the JSONB cast otherwise."""
+	metric = _registry.get(name) or Metric(_check_name(name))
+	if not metric.promoted:
+		return _json_expr(name)
+	if metric.backfilled:
+		return metric.column
+	return f"COALESCE({metric.column}, {_json_expr(name)})"
+
+
+@lru_cache(maxsize=int(os.getenv("METRIC_SELECT_CACHE_SIZE", "1024")))
+def _select_list(metrics: tuple, template: str) -> str:
+	return ", ".join(template.format(expr=metric_expr(m)) for m in metrics)
+
+
+def select_list(metrics, template: str = "{expr}") -> str:
+	"""``template`` applied to each metric's expression, comma-joined in the given order.
+
+	Cached per metric set; the cache is dropped whenever the registry reloads,
+	since promotion and backfill change the expressions.
+	"""
+	return _select_list(tuple(metrics), template)
+
+
+def _replace(found: dict):
+	_registry.clear()
+	_registry.update(found)
+	_select_list.cache_clear()
+
+
+def load_registry():
+	with get_db() as cur:
+		cur.execute("SELECT name, promoted, backfilled_at IS NOT NULL AS backfilled FROM metric_registry;")
+		rows = cur.fetchall()
+	found = {}
+	for row in rows:
+		if not _NAME_RE.match(row["name"]):
+			logger.warning("Ignoring invalid metric name in registry: %r", row["name"])
+			continue
+		found[row["name"]] = Metric(row["name"], row["promoted"], row["backfilled"])
+	_replace(found)
+
+
+def init_registry():
+	try:
+		load_registry()
+	except Exception:
+		logger.exception("Metric registry unavailable, using the default metric set")
+		_replace({m: Metric(m) for m in DEFAULT_METRICS})
+
+
+def register(name: str):
+	with get_db() as cur:
+		cur.execute(
+			"INSERT INTO metric_registry (name) VALUES (%s) ON CONFLICT (name) DO NOTHING;",
+			(_check_name(name),),
+		)
+
+
+def _fill_function_sql(names) -> str:
+	# only JSON numbers are copied, so one bad string can never reject an insert
+	assigns = "".join(
+		f"\tNEW.m_{n} := CASE WHEN jsonb_typeof(NEW.data->'{n}') = 'number' THEN {_json_expr(n, 'NEW.')} END;\n"
+		for n in names
+	)
+	return (
+		"CREATE OR REPLACE FUNCTION telemetry_fill_metrics() RETURNS trigger AS $$\n"
+		f"BEGIN\n{assigns}\tRETURN NEW;\nEND;\n$$ LANGUAGE plpgsql;"
+	)
+
+
+def promote(name: str):
+	"""Add a typed column for ``name`` and keep it filled on insert/update from then on.
+
+	Existing rows stay NULL (reads fall back to JSONB) until backfill() has run.
+	"""
+	_check_name(name)
+	with get_autocommit_db() as cur:
+		cur.execute(
+			"""
+			INSERT INTO metric_registry (name, promoted) VALUES (%s, true)
+			ON CONFLICT (name) DO UPDATE SET promoted = true;
+			""",
+			(name,),
+		)
+		cur.execute(f"ALTER TABLE telemetry ADD COLUMN IF NOT EXISTS m_{name} double precision;")
+		cur.execute("SELECT name FROM metric_registry WHERE promoted ORDER BY name;")
+		cur.execute(_fill_function_sql([row["name"] for row in cur.fetchall()]))
+		cur.execute(
+			"""
+			DROP TRIGGER IF EXISTS telemetry_fill_metrics ON telemetry;
+			CREATE TRIGGER telemetry_fill_metrics BEFORE INSERT OR UPDATE OF data ON telemetry
+			FOR EACH ROW EXECUTE FUNCTION telemetry_fill_metrics();
+			"""
+		)
+
+
+def backfill(name: str):
+	"""Populate a promoted column chunk by chunk (one transaction each) and flip reads to it."""
+	_check_name(name)
+	with get_autocommit_db() as cur:
+		cur.execute("SELECT promoted FROM metric_registry WHERE name=%s;", (name,))
+		row = cur.fetchone()
+		if not row or not row["promoted"]:
+			raise ValueError(f"Metric {name} is not promoted")
+		cur.execute("SELECT show_chunks('telemetry')::text AS chunk;")
+		chunks = [r["chunk"] for r in cur.fetchall()]
+		for chunk in chunks:
+			cur.execute(
+				f"""
+				UPDATE {chunk} SET m_{name} = {_json_expr(name)}
+				WHERE m_{name} IS NULL AND jsonb_typeof(data->'{name}') = 'number';
+				"""
+			)
+			logger.info("Backfilled %s in %s (%s rows)", name, chunk, cur.rowcount)
+		cur.execute("UPDATE metric_registry SET backfilled_at = now() WHERE name=%s;", (name,))
+
+
+if __name__ == "__main__":
+	logging.basicConfig(level=logging.INFO)
+	usage = "usage: python -m app.db.metric_registry [list|register NAME|promote NAME|backfill NAME]"
+	command = sys.argv[1] if len(sys.argv) > 1 else "list"
+	if command == "list":
+		load_registry()
+		for metric in sorted(_registry.values(), key=lambda m: m.name):
+			print(metric.name, "backfilled" if metric.backfilled else "promoted" if metric.promoted else "jsonb")
+	elif command in ("register", "promote", "backfill") and len(sys.argv) == 3:
+		{"register": register, "promote": promote, "backfill": backfill}[command](sys.argv[2])
+	else:
+		sys.exit(usage)
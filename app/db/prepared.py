@@ -0,0 +1,25 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Statement:
+	"""Fixed SQL run often enough that parsing and planning it every time shows up."""
+
+	name: str
+	sql: str
+
+
+_statements: dict = {}  # name -> Statement
+
+
+def statement(name: str, sql: str) -> Statement:
+	stmt = Statement(name, sql)
+	if _statements.setdefault(name, stmt) != stmt:
+		raise ValueError(f"Prepared statement {name} is already registered with different SQL")
+	return stmt
+
+
+async def execute_async(cur, stmt: Statement, params=()):
+	# psycopg 3 prepares server-side itself; prepare=True skips its warm-up of
+	# prepare_threshold executions per connection
+	await cur.execute(stmt.sql, params, prepare=True)
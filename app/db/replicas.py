@@ -0,0 +1,151 @@
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# hosts of streaming replicas (same DB_NAME/DB_USER/DB_PASSWORD as the primary)
+REPLICA_HOSTS = [h.strip() for h in os.getenv("DB_REPLICA_HOSTS", "").split(",") if h.strip()]
+POLICY = os.getenv("DB_REPLICA_POLICY", "round_robin")  # round_robin | least_conn
+MAX_LAG_S = float(os.getenv("DB_REPLICA_MAX_LAG_S", "5"))
+CHECK_S = float(os.getenv("DB_REPLICA_CHECK_S", "5"))
+# how long a replica that failed to hand out a connection is skipped, unless a health check revives it first
+RETRY_S = float(os.getenv("DB_REPLICA_RETRY_S", "30"))
+ACQUIRE_TIMEOUT_S = float(os.getenv("DB_REPLICA_TIMEOUT", "2"))
+# an idle primary only sends keepalives every wal_sender_timeout / 2, so keep this above that
+RECEIVER_TIMEOUT_S = float(os.getenv("DB_REPLICA_RECEIVER_TIMEOUT_S", "60"))
+
+# replay lag in seconds; 0 when the replica has applied everything it received.
+# NULL (treated as unhealthy) when it never replayed anything or its WAL receiver
+# is not streaming: having applied all it received means nothing once it stops receiving
+# (the DB_USER role needs pg_read_all_stats to see pg_stat_wal_receiver's details)
+LAG_SQL = """
+	SELECT CASE
+		WHEN NOT pg_is_in_recovery() THEN 0
+		WHEN NOT EXISTS (
+			SELECT 1 FROM pg_stat_wal_receiver
+			WHERE status = 'streaming' AND last_msg_receipt_time > now() - make_interval(secs => %s)
+		) THEN NULL
+		WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+		ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+	END AS lag;
+"""
+
+_primary_only = contextvars.ContextVar("primary_only", default=False)
+
+
+class Replica:
+	def __init__(self, host: str):
+		self.host = host
+		self.healthy = False  # until the first health check says otherwise
+		self.lag: float | None = None
+		self.in_use = 0
+		self.down_until = 0.0
+		self.checked_at: float | None = None
+
+	def available(self, now: float) -> bool:
+		return self.healthy and self.lag is not None and self.lag <= MAX_LAG_S and now >= self.down_until
+
+
+class ReplicaSet:
+	"""Health and load of the read replicas; picks one for read-only work or None for the primary."""
+
+	def __init__(self, hosts):
+		self.replicas = [Replica(h) for h in hosts]
+		self._next = itertools.count()
+		self._lock = threading.Lock()
+		self.routed = 0
+		self.fallbacks = 0
+
+	def pick(self) -> Replica | None:
+		if not self.replicas or _primary_only.get():
+			return None
+		now = time.monotonic()
+		with self._lock:
+			candidates = [r for r in self.replicas if r.available(now)]
+			if not candidates:
+				self.fallbacks += 1
+				return None
+			if POLICY == "least_conn":
+				replica = min(candidates, key=lambda r: r.in_use)
+			else:
+				replica = candidates[next(self._next) % len(candidates)]
+			replica.in_use += 1
+			self.routed += 1
+			return replica
+
+	def release(self, replica: Replica):
+		with self._lock:
+			replica.in_use -= 1
+
+	def failed(self, replica: Replica):
+		"""The replica could not hand out a connection: release it and route around it for a while."""
+		with self._lock:
+			replica.in_use -= 1
+			replica.down_until = time.monotonic() + RETRY_S
+			self.fallbacks += 1
+
+	def record_check(self, replica: Replica, lag: float | None):
+		with self._lock:
+			replica.checked_at = time.monotonic()
+			replica.healthy = lag is not None
+			replica.lag = float(lag) if lag is not None else None
+			if replica.healthy:
+				replica.down_until = 0.0
+
+	def stats(self) -> dict:
+		now = time.monotonic()
+		with self._lock:
+			return {
+				"policy": POLICY,
+				"max_lag_s": MAX_LAG_S,
+				"routed": self.routed,
+				"fallbacks": self.fallbacks,
+				"replicas": [
+					{
+						"host": r.host,
+						"available": r.available(now),
+						"healthy": r.healthy,
+						"lag_s": r.lag,
+						"in_use": r.in_use,
+						"checked_s_ago": now - r.checked_at if r.checked_at is not None else None,
+					}
+					for r in self.replicas
+				],
+			}
+
+
+replicas = ReplicaSet(REPLICA_HOSTS)
+
+
+def on_replica(cur) -> bool:
+	"""Whether a cursor from get_db/get_async_db was routed to a replica."""
+	return getattr(cur, "replica", None) is not None
+
+
+@contextmanager
+def primary_reads():
+	"""Route read-only work in this context to the primary, e.g. to read one's own writes."""
+	token = _primary_only.set(True)
+	try:
+		yield
+	finally:
+		_primary_only.reset(token)
+
+
+class ReadYourWritesMiddleware:
+	"""Requests carrying ``X-Read-Your-Writes: 1`` read from the primary only."""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] in ("http", "websocket"):
+			value = dict(scope["headers"]).get(b"x-read-your-writes", b"").lower()
+			if value in (b"1", b"true", b"yes"):
+				with primary_reads():
+					await self.app(scope, receive, send)
+				return
+		await self.app(scope, receive, send)
@@ -0,0 +1,244 @@
+import logging
+import math
+import os
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from app.db.connection import get_db, get_autocommit_db
+from app.db.metric_registry import metric_expr
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Tier:
+	view: str
+	seconds: int
+	start_offset: str
+	schedule: str
+
+
+# Continuous aggregates over telemetry, finest first
+TIERS = (
+	Tier("telemetry_1m", 60, "1 day", "1 minute"),
+	Tier("telemetry_1h", 3600, "7 days", "30 minutes"),
+	Tier("telemetry_1d", 86400, "30 days", "1 hour"),
+)
+
+# view name -> metrics it materializes, filled by load_rollups()
+_available: dict = {}
+
+
+def _create_sql(tier: Tier, metrics) -> str:
+	aggs = []
+	for m in metrics:
+		expr = metric_expr(m)
+		aggs.append(f"count({expr}) AS {m}_count, sum({expr}) AS {m}_sum, min({expr}) AS {m}_min, max({expr}) AS {m}_max")
+	return f"""
+		CREATE MATERIALIZED VIEW IF NOT EXISTS {tier.view}
+		WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+		SELECT device_id, time_bucket(INTERVAL '{tier.seconds} seconds', ts) AS bucket, {", ".join(aggs)}
+		FROM telemetry
+		GROUP BY device_id, bucket
+		WITH NO DATA;
+	"""
+
+
+def ensure_rollups(metrics):
+	"""Create the continuous aggregates and their refresh policies if missing."""
+	with get_autocommit_db() as cur:
+		for tier in TIERS:
+			cur.execute(_create_sql(tier, metrics))
+			cur.execute(
+				"""
+				SELECT add_continuous_aggregate_policy(%s,
+					start_offset => %s::interval,
+					end_offset => make_interval(secs => %s),
+					schedule_interval => %s::interval,
+					if_not_exists => true);
+				""",
+				(tier.view, tier.start_offset, tier.seconds, tier.schedule),
+			)
+
+
+def refresh_rollups():
+	"""Materialize the full history, e.g. right after ensure_rollups on an existing table."""
+	with get_autocommit_db() as cur:
+		for tier in TIERS:
+			cur.execute("CALL refresh_continuous_aggregate(%s, NULL, NULL);", (tier.view,))
+
+
+def load_rollups():
+	with get_db() as cur:
+		cur.execute(
+			"""
+			SELECT c.table_name, c.column_name
+			FROM information_schema.columns c
+			JOIN timescaledb_information.continuous_aggregates a ON a.view_name = c.table_name
+			WHERE a.hypertable_name = 'telemetry' AND c.column_name LIKE '%\\_sum'
+			"""
+		)
+		found: dict = {}
+		for row in cur.fetchall():
+			found.setdefault(row["table_name"], set()).add(row["column_name"][:-len("_sum")])
+	_available.clear()
+	_available.update({view: frozenset(ms) for view, ms in found.items() if view in {t.view for t in TIERS}})
+
+
+def init_rollups(metrics):
+	try:
+		if os.getenv("ROLLUPS_ENABLED", "0") == "1":
+			ensure_rollups(metrics)
+		load_rollups()
+	except Exception:
+		logger.exception("Rollup tiers unavailable, querying raw telemetry only")
+		_available.clear()
+
+
+def pick_tier(metrics, span_seconds: float, resolution: float | None = None) -> Tier | None:
+	"""Coarsest materialized tier that fits at least two buckets into the window
+	and, when a resolution is requested, divides it evenly."""
+	best = None
+	for tier in TIERS:
+		if not set(metrics) <= _available.get(tier.view, frozenset()):
+			continue
+		if tier.seconds * 2 > span_seconds:
+			continue
+		if resolution is not None and (resolution < tier.seconds or not math.isclose(resolution % tier.seconds, 0, abs_tol=1e-6)):
+			continue
+		best = tier
+	return best
+
+
+def snap_resolution(seconds: float) -> float:
+	"""Round a derived bucket width up to a whole number of the largest tier it spans."""
+	for tier in reversed(TIERS):
+		if seconds >= tier.seconds:
+			return math.ceil(seconds / tier.seconds) * tier.seconds
+	return seconds
+
+
+def _align(ts: datetime, seconds: int, up: bool) -> datetime:
+	epoch = ts.timestamp() / seconds
+	return datetime.fromtimestamp((math.ceil(epoch) if up else math.floor(epoch)) * seconds, tz=timezone.utc)
+
+
+def aggregate_query(metrics, device_ids, start: datetime, end: datetime | None = None, bucket_seconds: float | None = None):
+	"""avg/min/max per device (and per ``bucket_seconds`` bucket when given) over [start, end].
+
+	The aligned interior of the window is read from the coarsest suitable tier;
+	the unaligned edges come from raw telemetry, and the tier itself falls back
+	to raw rows for whatever it has not materialized yet. Returns (sql, params)
+	producing device_id, [ts,] {metric}_avg, {metric}_min, {metric}_max.
+	"""
+	upper = end or datetime.now(tz=timezone.utc)
+	tier = pick_tier(metrics, (upper - start).total_seconds(), bucket_seconds)
+	inner_start = inner_end = None
+	if tier is not None:
+		inner_start, inner_end = _align(start, tier.seconds, up=True), _align(upper, tier.seconds, up=False)
+		if inner_start >= inner_end:
+			tier = None
+
+	def part(source: str, ts_col: str, aggs: str, ranges: list):
+		key = "device_id"
+		params: list = []
+		if bucket_seconds is not None:
+			key += f", time_bucket(make_interval(secs => %s), {ts_col}) AS ts"
+			params.append(bucket_seconds)
+		params.append(list(device_ids))
+		conds = []
+		for lo, lo_op, hi, hi_op in ranges:
+			cond = [f"{ts_col} {lo_op} %s"]
+			params.append(lo)
+			if hi is not None:
+				cond.append(f"{ts_col} {hi_op} %s")
+				params.append(hi)
+			conds.append("(" + " AND ".join(cond) + ")")
+		# positional: a bare "ts" in GROUP BY would bind to the raw column, not the bucket alias
+		group = "1, 2" if bucket_seconds is not None else "1"
+		sql = f"SELECT {key}, {aggs} FROM {source} WHERE device_id = ANY(%s) AND ({' OR '.join(conds)}) GROUP BY {group}"
+		return sql, params
+
+	raw_aggs = ", ".join(
+		f"count({metric_expr(m)}) AS {m}_count, sum({metric_expr(m)}) AS {m}_sum, "
+		f"min({metric_expr(m)}) AS {m}_min, max({metric_expr(m)}) AS {m}_max"
+		for m in metrics
+	)
+	if tier is None:
+		parts = [part("telemetry", "ts", raw_aggs, [(start, ">=", end, "<=")])]
+	else:
+		tier_aggs = ", ".join(
+			f"sum({m}_count) AS {m}_count, sum({m}_sum) AS {m}_sum, min({m}_min) AS {m}_min, max({m}_max) AS {m}_max"
+			for m in metrics
+		)
+		parts = [
+			part("telemetry", "ts", raw_aggs, [(start, ">=", inner_start, "<"), (inner_end, ">=", end, "<=")]),
+			part(tier.view, "bucket", tier_aggs, [(inner_start, ">=", inner_end, "<")]),
+		]
+
+	final = ", ".join(
+		f"sum({m}_sum) / nullif(sum({m}_count), 0) AS {m}_avg, min({m}_min) AS {m}_min, max({m}_max) AS {m}_max"
+		for m in metrics
+	)
+	group = "device_id" + (", ts" if bucket_seconds is not None else "")
+	union_sql = " UNION ALL ".join(sql for sql, _ in parts)
+	params = [p for _, ps in parts for p in ps]
+	sql = f"SELECT {group}, {final} FROM ({union_sql}) parts GROUP BY {group} ORDER BY {group}"
+	return sql, params
+
+
+
+FLEET_AGGS = {
+	"sum": "sum({m}_avg)",
+	"avg": "avg({m}_avg)",
+	"min": "min({m}_min)",
+	"max": "max({m}_max)",
+}
+
+
+def fleet_query(metrics, device_ids, start: datetime, end: datetime, bucket_seconds: float, aggs, fill: str = "locf"):
+	"""Cross-device aggregates on a gap-filled bucket grid over [start, end].
+
+	Each device is reduced to one avg/min/max per bucket (tiers included, see
+	aggregate_query), the grid is completed per device with
+	time_bucket_gapfill - carrying the last value forward when ``fill`` is
+	"locf" - and the buckets are then folded across devices: sum/avg of the
+	device averages, min of the minimums, max of the maximums. Returns
+	(sql, params) producing ts, devices, {metric}_{agg}.
+	"""
+	per_device_sql, params = aggregate_query(metrics, device_ids, start, end, bucket_seconds)
+	wrap = "locf({})" if fill == "locf" else "{}"
+	filled = ", ".join(
+		f"{wrap.format(f'avg({m}_avg)')} AS {m}_avg, {wrap.format(f'min({m}_min)')} AS {m}_min, "
+		f"{wrap.format(f'max({m}_max)')} AS {m}_max"
+		for m in metrics
+	)
+	folded = ", ".join(FLEET_AGGS[agg].format(m=m) + f" AS {m}_{agg}" for m in metrics for agg in aggs)
+	# a device counts towards a bucket once it has any (possibly carried) value
+	present = " OR ".join(f"{m}_avg IS NOT NULL" for m in metrics)
+	sql = f"""
+		WITH per_device AS ({per_device_sql}),
+		filled AS (
+			SELECT time_bucket_gapfill(make_interval(secs => %s), ts, %s, %s) AS ts, device_id, {filled}
+			FROM per_device
+			GROUP BY 1, 2
+		)
+		SELECT ts, count(*) FILTER (WHERE {present}) AS devices, {folded}
+		FROM filled
+		GROUP BY ts
+		ORDER BY ts
+	"""
+	return sql, params + [bucket_seconds, start, end]
+
+
+if __name__ == "__main__":
+	from app.db.metric_registry import DEFAULT_METRICS
+
+	command = sys.argv[1] if len(sys.argv) > 1 else "create"
+	if command == "create":
+		ensure_rollups(DEFAULT_METRICS)
+	elif command == "refresh":
+		refresh_rollups()
+	else:
+		sys.exit("usage: python -m app.db.rollups [create|refresh]")
@@ -0,0 +1,108 @@
+import base64
+import json
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from app.db.prepared import statement
+
+
+# ON CONFLICT clauses for a duplicate (device_id, ts) primary key
+CONFLICT_POLICIES = {
+	"skip": "ON CONFLICT (device_id, ts) DO NOTHING",
+	"overwrite": "ON CONFLICT (device_id, ts) DO UPDATE SET data = EXCLUDED.data, inserted_at = now()",
+	"merge": "ON CONFLICT (device_id, ts) DO UPDATE SET data = telemetry.data || EXCLUDED.data, inserted_at = now()",
+}
+
+INSERT_ONE = statement(
+	"telemetry_insert",
+	"""
+	INSERT INTO telemetry (device_id, ts, data)
+	VALUES (%s, to_timestamp(%s/1000.0), %s::jsonb);
+	""",
+)
+
+# 3 bind parameters per row keeps each statement well under the 65535 limit
+INSERT_CHUNK = 1000
+
+
+def dedupe_samples(samples, policy: str):
+	"""Collapse samples sharing a (device_id, ts) key.
+
+	A single INSERT .. ON CONFLICT DO UPDATE may not touch the same row twice,
+	so in-batch duplicates are resolved here with the same policy the database
+	applies to rows that already exist. Returns (rows, dropped_per_device).
+	"""
+	rows: dict = {}
+	dropped: Counter = Counter()
+	for device_id, ts, data in samples:
+		key = (device_id, ts)
+		if key not in rows:
+			rows[key] = data
+		elif policy == "skip":
+			dropped[device_id] += 1
+		elif policy == "overwrite":
+			rows[key] = data
+		else:
+			rows[key] = {**rows[key], **data}
+	return [(d, ts, data) for (d, ts), data in rows.items()], dropped
+
+
+def build_insert(rows, policy: str):
+	values = ", ".join(["(%s, to_timestamp(%s/1000.0), %s::jsonb)"] * len(rows))
+	params: list = []
+	for device_id, ts, data in rows:
+		params.extend((device_id, ts, json.dumps(data)))
+	sql = f"INSERT INTO telemetry (device_id, ts, data) VALUES {values} {CONFLICT_POLICIES[policy]} RETURNING device_id, ts;"
+	return sql, params
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def ms_to_datetime(ts_ms: int) -> datetime:
+	return EPOCH + timedelta(milliseconds=ts_ms)
+
+
+def datetime_to_ms(ts: datetime) -> int:
+	return (ts - EPOCH) // timedelta(milliseconds=1)
+
+
+def insert_samples(cur, samples, policy: str = "skip") -> list:
+	"""Multi-row insert of (device_id, ts_ms, data) tuples.
+
+	Returns the (device_id, ts_ms) keys actually written; rows skipped by the
+	conflict policy are left out.
+	"""
+	if policy not in CONFLICT_POLICIES:
+		raise ValueError(f"Unknown conflict policy: {policy}")
+	written = []
+	for i in range(0, len(samples), INSERT_CHUNK):
+		sql, params = build_insert(samples[i:i + INSERT_CHUNK], policy)
+		cur.execute(sql, params)
+		written.extend((row["device_id"], datetime_to_ms(row["ts"])) for row in cur.fetchall())
+	return written
+
+
+async def insert_samples_async(cur, samples, policy: str = "skip") -> list:
+	if policy not in CONFLICT_POLICIES:
+		raise ValueError(f"Unknown conflict policy: {policy}")
+	written = []
+	for i in range(0, len(samples), INSERT_CHUNK):
+		sql, params = build_insert(samples[i:i + INSERT_CHUNK], policy)
+		await cur.execute(sql, params)
+		written.extend((row["device_id"], datetime_to_ms(row["ts"])) for row in await cur.fetchall())
+	return written
+
+
+def encode_cursor(ts: datetime, device_id: str) -> str:
+	"""Opaque keyset position: the (ts, device_id) of the last row on a page."""
+	micros = (ts - EPOCH) // timedelta(microseconds=1)
+	return base64.urlsafe_b64encode(f"{micros}:{device_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str):
+	try:
+		raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+		micros, device_id = raw.split(":", 1)
+		return EPOCH + timedelta(microseconds=int(micros)), device_id
+	except (ValueError, UnicodeDecodeError, OverflowError):
+		raise ValueError("Invalid cursor")
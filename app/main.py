@@ -1,8 +1,67 @@
-from fastapi import FastAPI
-from app.api import organisation, site, plant, telemetry, user, device, charts, test, auth
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.api import organisation, site, plant, telemetry, user, device, charts, test, auth, alert
+from psycopg_pool import PoolTimeout as AsyncPoolTimeout
+from app.db.connection import PoolTimeout, open_pool, close_pool
+from app.db.async_connection import open_async_pool, close_async_pool
+from app.db.replicas import ReadYourWritesMiddleware, replicas
+from app.core.ingest import start_buffer, stop_buffer
+from app.core.passwords import start_password_pool, stop_password_pool
+from app.core.latest import warm_store
+from app.core.live import broker
+from app.core.alerts import engine as alerts
+from app.core.energy import ledger
+from app.core.instrumentation import TimingMiddleware, render as render_metrics
+from app.db.rollups import init_rollups
+from app.db.metric_registry import DEFAULT_METRICS, init_registry
 
 
-app = FastAPI(title="Industrial IoT API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	open_pool()
+	await open_async_pool()
+	warm_store()
+	init_registry()
+	init_rollups(DEFAULT_METRICS)
+	await broker.start()
+	await alerts.start()
+	ledger.start()
+	start_buffer()
+	start_password_pool()
+	try:
+		yield
+	finally:
+		stop_password_pool()
+		await asyncio.get_running_loop().run_in_executor(None, stop_buffer)
+		await ledger.stop()
+		await alerts.stop()
+		await broker.stop()
+		await close_async_pool()
+		close_pool()
+
+
+app = FastAPI(title="Industrial IoT API", lifespan=lifespan)
+app.add_middleware(TimingMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+
+
+@app.exception_handler(PoolTimeout)
+@app.exception_handler(AsyncPoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+	return JSONResponse(status_code=503, content={"detail": "Database busy, retry later"}, headers={"Retry-After": "1"})
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+	return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health/replicas", include_in_schema=False)
+def replica_health():
+	return replicas.stats()
+
 
 app.include_router(organisation.router)
 app.include_router(site.router)
@@ -13,5 +72,4 @@ app.include_router(device.router)
 app.include_router(charts.router)
 app.include_router(test.router)
 app.include_router(auth.router)
-
-
+app.include_router(alert.router)
@@ -0,0 +1,33 @@
+from pydantic import BaseModel
+from typing import Literal
+
+
+class AlertRuleBase(BaseModel):
+	device_id: str
+	metric: str
+	kind: Literal["threshold", "rate", "zscore"]
+	lower: float | None = None
+	upper: float | None = None
+	max_rate: float | None = None
+	z_limit: float | None = None
+	alpha: float | None = None
+	min_samples: int = 30
+	cooldown_s: float = 300
+	enabled: bool = True
+
+
+class AlertRuleCreate(AlertRuleBase):
+	pass
+
+
+class AlertRuleUpdate(BaseModel):
+	metric: str | None = None
+	kind: Literal["threshold", "rate", "zscore"] | None = None
+	lower: float | None = None
+	upper: float | None = None
+	max_rate: float | None = None
+	z_limit: float | None = None
+	alpha: float | None = None
+	min_samples: int | None = None
+	cooldown_s: float | None = None
+	enabled: bool | None = None
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, List, Literal
 
 
 class TelemetryIn(BaseModel):
@@ -8,3 +8,6 @@ class TelemetryIn(BaseModel):
 	data: Dict[str, Any]
 
 
+class TelemetryBatchIn(BaseModel):
+	samples: List[TelemetryIn]
+	on_conflict: Literal["skip", "overwrite", "merge"] = "skip"
@@ -0,0 +1,2 @@
+"""Load and latency benchmarks against a running API."""
+
@@ -0,0 +1,58 @@
+"""Compare two bench.run reports.
+
+    python -m bench.compare baseline.json candidate.json
+
+Prints one line per endpoint and metric with the relative change; latency
+and DB-call increases beyond --threshold percent are marked as regressions.
+"""
+import argparse
+import json
+import sys
+
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "db_calls_per_request")
+# higher is better only for throughput
+HIGHER_IS_BETTER = {"throughput_rps"}
+
+
+def compare(base: dict, new: dict, threshold: float) -> tuple:
+	lines = []
+	regressions = 0
+	for name in sorted(set(base["endpoints"]) | set(new["endpoints"])):
+		a = base["endpoints"].get(name)
+		b = new["endpoints"].get(name)
+		if a is None or b is None:
+			lines.append(f"{name:<16} only in {'candidate' if a is None else 'baseline'}")
+			continue
+		for metric in METRICS:
+			if metric not in a or metric not in b:
+				continue
+			old, cur = a[metric], b[metric]
+			change = (cur - old) / old * 100 if old else 0.0
+			worse = -change if metric in HIGHER_IS_BETTER else change
+			flag = ""
+			if worse > threshold:
+				flag = "  REGRESSION"
+				regressions += 1
+			lines.append(f"{name:<16} {metric:<22} {old:>10} -> {cur:>10}  {change:+7.1f}%{flag}")
+	return lines, regressions
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("baseline")
+	parser.add_argument("candidate")
+	parser.add_argument("--threshold", type=float, default=10.0, help="percent change treated as a regression")
+	args = parser.parse_args(argv)
+	with open(args.baseline, encoding="utf-8") as f:
+		base = json.load(f)
+	with open(args.candidate, encoding="utf-8") as f:
+		new = json.load(f)
+	lines, regressions = compare(base, new, args.threshold)
+	print(f"baseline {base['meta'].get('revision')}  candidate {new['meta'].get('revision')}")
+	print("\n".join(lines))
+	sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+	main()
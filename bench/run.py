@@ -0,0 +1,317 @@
+"""Drive the API with a fixed request mix and report latency per endpoint.
+
+    python -m bench.run --base-url http://localhost:8000 --concurrency 16 --duration 60 --out run.json
+
+Each worker thread keeps one keep-alive connection and draws endpoints from
+the profile with its own seeded RNG, so the request sequence is the same on
+every run. Results are JSON: throughput and p50/p95/p99 latency per endpoint,
+plus database statement counts per request taken from pg_stat_statements
+(transaction counts from pg_stat_database when the extension is missing).
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from app.db.connection import _get_connection
+
+
+# endpoint -> relative weight
+PROFILES = {
+	"mixed": {"ingest": 40, "timeseries": 25, "overview": 20, "telemetry_list": 10, "test_run": 5},
+	"ingest": {"ingest": 1},
+	"dashboard": {"timeseries": 50, "overview": 40, "telemetry_list": 10},
+	"charts": {"timeseries": 1},
+}
+
+
+class Client:
+	"""One keep-alive HTTP connection with a bearer token."""
+
+	def __init__(self, base_url: str, token: str | None = None, timeout: float = 30):
+		url = urllib.parse.urlsplit(base_url)
+		conn_cls = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+		self._conn = conn_cls(url.netloc, timeout=timeout)
+		self.token = token
+
+	def request(self, method: str, path: str, body=None, headers=None):
+		headers = dict(headers or {})
+		if self.token:
+			headers["Authorization"] = f"Bearer {self.token}"
+		if isinstance(body, (dict, list)):
+			body = json.dumps(body)
+			headers["Content-Type"] = "application/json"
+		try:
+			self._conn.request(method, path, body=body, headers=headers)
+			resp = self._conn.getresponse()
+		except (http.client.HTTPException, OSError):
+			# the server may close an idle keep-alive connection; reconnect once
+			self._conn.close()
+			self._conn.request(method, path, body=body, headers=headers)
+			resp = self._conn.getresponse()
+		return resp.status, resp.read()
+
+	def close(self):
+		self._conn.close()
+
+
+def login(base_url: str, username: str, password: str) -> str:
+	client = Client(base_url)
+	status, body = client.request(
+		"POST",
+		"/auth/login",
+		body=urllib.parse.urlencode({"username": username, "password": password}),
+		headers={"Content-Type": "application/x-www-form-urlencoded"},
+	)
+	client.close()
+	if status != 200:
+		raise SystemExit(f"login failed ({status}): {body[:200]!r}")
+	return json.loads(body)["access_token"]
+
+
+class Scenario:
+	"""Builds the next request for an endpoint name."""
+
+	def __init__(self, devices: list, worker: int, args):
+		self.devices = devices
+		self.args = args
+		# ingest writes only this worker's share of devices, with strictly rising
+		# timestamps, so no two workers ever insert the same (device_id, ts) key
+		self.own_devices = devices[worker % args.concurrency::args.concurrency] or [devices[worker % len(devices)]]
+		self.last_ts = 0
+
+	def __call__(self, name: str, rng: random.Random):
+		device_id = rng.choice(self.devices)
+		now_ms = int(time.time() * 1000)
+		if name == "ingest":
+			self.last_ts = max(now_ms, self.last_ts + 1)
+			return "POST", "/telemetry/", {
+				"device_id": rng.choice(self.own_devices),
+				"ts": self.last_ts,
+				"data": {"active_power_total": rng.uniform(0, 30), "pf_total": rng.uniform(0.8, 1)},
+			}
+		if name == "timeseries":
+			start = now_ms - int(self.args.window_hours * 3600 * 1000)
+			query = urllib.parse.urlencode({"start_ms": start, "end_ms": now_ms, "max_points": 500})
+			return "GET", f"/charts/timeseries/{device_id}?{query}", None
+		if name == "overview":
+			return "GET", f"/charts/overview/{device_id}", None
+		if name == "telemetry_list":
+			return "GET", "/telemetry/?limit=100", None
+		if name == "test_run":
+			return "GET", f"/test/run?device_limit=5&hours={int(self.args.window_hours)}", None
+		raise ValueError(f"Unknown endpoint: {name}")
+
+
+def percentile(sorted_values: list, q: float) -> float:
+	"""Nearest-rank percentile of an already sorted list."""
+	if not sorted_values:
+		return 0.0
+	rank = max(1, -(-len(sorted_values) * q // 100))
+	return sorted_values[int(rank) - 1]
+
+
+def summarize(samples: list, seconds: float) -> dict:
+	latencies = sorted(ms for _, ms in samples)
+	errors = sum(1 for status, _ in samples if status >= 400)
+	return {
+		"requests": len(samples),
+		"errors": errors,
+		"throughput_rps": round(len(samples) / seconds, 2) if seconds else 0.0,
+		"mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+		"p50_ms": round(percentile(latencies, 50), 3),
+		"p95_ms": round(percentile(latencies, 95), 3),
+		"p99_ms": round(percentile(latencies, 99), 3),
+		"max_ms": round(latencies[-1], 3) if latencies else 0.0,
+	}
+
+
+class DbCounter:
+	"""Server-wide statement (or transaction) counter for the app database."""
+
+	def __init__(self):
+		self._conn = _get_connection()
+		self._conn.autocommit = True
+		with self._conn.cursor() as cur:
+			cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements';")
+			self.source = "pg_stat_statements" if cur.fetchone() else "pg_stat_database"
+
+	def read(self) -> int:
+		with self._conn.cursor() as cur:
+			if self.source == "pg_stat_statements":
+				cur.execute(
+					"""
+					SELECT coalesce(sum(s.calls), 0) FROM pg_stat_statements s
+					JOIN pg_database d ON d.oid = s.dbid WHERE d.datname = current_database();
+					"""
+				)
+			else:
+				cur.execute(
+					"SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database();"
+				)
+			# the reading statement itself is counted on the next read
+			return int(cur.fetchone()[0]) - 1
+
+	def close(self):
+		self._conn.close()
+
+
+def calibrate(args, token: str, devices: list, endpoints, counter: DbCounter | None) -> dict:
+	"""Statements per request for each endpoint, measured one endpoint at a time."""
+	if counter is None:
+		return {}
+	client = Client(args.base_url, token)
+	scenario = Scenario(devices, worker=0, args=args)
+	rng = random.Random(args.seed)
+	per_request = {}
+	for name in endpoints:
+		# one unmeasured call so connection pools and caches are warm
+		client.request(*scenario(name, rng))
+		before = counter.read()
+		for _ in range(args.calibrate):
+			client.request(*scenario(name, rng))
+		# ingest in async mode lands a moment later; give the flusher a chance
+		time.sleep(args.settle)
+		per_request[name] = round((counter.read() - before) / args.calibrate, 2)
+	client.close()
+	return per_request
+
+
+def worker(index: int, args, token: str, devices: list, weights: dict, start_at: float, record_from: float, stop_at: float, out: list):
+	client = Client(args.base_url, token)
+	rng = random.Random(args.seed * 1000 + index)
+	scenario = Scenario(devices, index, args)
+	names, shares = list(weights), list(weights.values())
+	samples = []
+	while time.monotonic() < start_at:
+		time.sleep(0.001)
+	while True:
+		now = time.monotonic()
+		if now >= stop_at:
+			break
+		name = rng.choices(names, weights=shares)[0]
+		method, path, body = scenario(name, rng)
+		started = time.perf_counter()
+		try:
+			status, _ = client.request(method, path, body)
+		except (http.client.HTTPException, OSError):
+			status = 599
+		elapsed_ms = (time.perf_counter() - started) * 1000
+		if now >= record_from:
+			samples.append((name, status, elapsed_ms))
+	client.close()
+	out.extend(samples)
+
+
+def git_revision() -> str | None:
+	try:
+		return subprocess.run(
+			["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def run(args) -> dict:
+	started_at = datetime.now(tz=timezone.utc).isoformat()
+	weights = PROFILES[args.profile] if not args.weights else {
+		k: float(v) for k, v in (part.split("=") for part in args.weights.split(","))
+	}
+	token = login(args.base_url, args.username, args.password)
+	client = Client(args.base_url, token)
+	status, body = client.request("GET", "/device/")
+	client.close()
+	devices = sorted(d["device_id"] for d in json.loads(body)) if status == 200 else []
+	if not devices:
+		raise SystemExit("no devices visible to the benchmark user; run python -m bench.seed first")
+
+	try:
+		counter = DbCounter() if not args.no_db else None
+	except Exception as e:
+		print(f"database counters unavailable: {e}")
+		counter = None
+	per_request = calibrate(args, token, devices, weights, counter)
+
+	results: list = []
+	start_at = time.monotonic() + 0.5
+	record_from = start_at + args.warmup
+	stop_at = record_from + args.duration
+	threads = []
+	buckets = [[] for _ in range(args.concurrency)]
+	for i in range(args.concurrency):
+		t = threading.Thread(
+			target=worker,
+			args=(i, args, token, devices, weights, start_at, record_from, stop_at, buckets[i]),
+			daemon=True,
+		)
+		t.start()
+		threads.append(t)
+	while time.monotonic() < record_from:
+		time.sleep(0.01)
+	db_before = counter.read() if counter is not None else None
+	for t in threads:
+		t.join()
+	db_after = counter.read() if counter is not None else None
+	if counter is not None:
+		counter.close()
+	for bucket in buckets:
+		results.extend(bucket)
+
+	endpoints = {}
+	for name in weights:
+		samples = [(status, ms) for n, status, ms in results if n == name]
+		endpoints[name] = summarize(samples, args.duration)
+		if name in per_request:
+			endpoints[name]["db_calls_per_request"] = per_request[name]
+	total = summarize([(status, ms) for _, status, ms in results], args.duration)
+	if db_before is not None:
+		total["db_calls"] = db_after - db_before
+		total["db_calls_per_request"] = round(total["db_calls"] / total["requests"], 2) if total["requests"] else 0.0
+	return {
+		"meta": {
+			"started_at": started_at,
+			"revision": git_revision(),
+			"python": platform.python_version(),
+			"db_counter": counter.source if counter is not None else None,
+			"env": {k: v for k, v in os.environ.items() if k.startswith(("DB_POOL_", "TELEMETRY_", "LIVE_", "ROLLUPS_"))},
+			"args": {k: v for k, v in vars(args).items() if k != "password"},
+			"devices": len(devices),
+		},
+		"endpoints": endpoints,
+		"total": total,
+	}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--base-url", default="http://localhost:8000")
+	parser.add_argument("--username", default="bench-o0")
+	parser.add_argument("--password", default="bench")
+	parser.add_argument("--profile", choices=sorted(PROFILES), default="mixed")
+	parser.add_argument("--weights", help="override the profile, e.g. ingest=3,overview=1")
+	parser.add_argument("--concurrency", type=int, default=8)
+	parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+	parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before that")
+	parser.add_argument("--window-hours", type=float, default=24, help="chart/test time window")
+	parser.add_argument("--calibrate", type=int, default=20, help="sequential requests per endpoint for DB counts")
+	parser.add_argument("--settle", type=float, default=0.5, help="seconds to wait after each calibration batch")
+	parser.add_argument("--seed", type=int, default=42)
+	parser.add_argument("--no-db", action="store_true", help="skip database statement counts")
+	parser.add_argument("--out", help="write the JSON report here instead of stdout")
+	args = parser.parse_args(argv)
+	report = json.dumps(run(args), indent=2)
+	if args.out:
+		with open(args.out, "w", encoding="utf-8") as f:
+			f.write(report + "\n")
+	else:
+		print(report)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,154 @@
+"""Seed a synthetic fleet for benchmarking.
+
+    python -m bench.seed --schema --orgs 1 --sites 2 --plants 2 --devices 10 --days 7 --interval 60
+
+Everything it creates is prefixed ``bench-`` and derived from ``--seed``:
+two runs with the same arguments produce the same fleet and sample values,
+ending at the current minute. Each org gets a login ``bench-o<N>`` /
+``bench`` with role admin.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from passlib.hash import pbkdf2_sha256
+from app.db.connection import _get_connection
+from app.db.metric_registry import DEFAULT_METRICS
+
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql_file.sql")
+# everything after this marker in sql_file.sql is example data and ad-hoc maintenance
+SCHEMA_END = "-- EXAMPLE HIERARCHY SEED DATA"
+PASSWORD = "bench"
+
+
+def schema_sql() -> str:
+	with open(SCHEMA_FILE, encoding="utf-8") as f:
+		text = f.read()
+	end = text.find(SCHEMA_END)
+	return text if end < 0 else text[:text.rfind("\n", 0, end)]
+
+
+def fleet(orgs: int, sites: int, plants: int, devices: int):
+	"""Yield (org_id, site_id, plant_id, device_id) for the whole hierarchy."""
+	for o in range(orgs):
+		org_id = f"bench-o{o}"
+		for s in range(sites):
+			site_id = f"{org_id}-s{s}"
+			for p in range(plants):
+				plant_id = f"{site_id}-p{p}"
+				for d in range(devices):
+					yield org_id, site_id, plant_id, f"{plant_id}-d{d}"
+
+
+def sample(rng: random.Random, phase: float, t: float, energy: float) -> dict:
+	# a daily load curve plus noise, so buckets and LTTB have real shape to work on
+	load = 0.6 + 0.4 * math.sin(2 * math.pi * (t / 86400 + phase))
+	values = {
+		"voltage_ll_avg": 415 + rng.gauss(0, 3),
+		"current_avg": 40 * load + rng.gauss(0, 1),
+		"frequency": 50 + rng.gauss(0, 0.05),
+		"pf_total": min(1.0, 0.9 + 0.08 * load + rng.gauss(0, 0.01)),
+		"active_power_total": 25 * load + rng.gauss(0, 0.5),
+		"thd_v_r": abs(2 + rng.gauss(0, 0.4)),
+		"energy_kwh": energy,
+	}
+	return {m: round(values[m], 4) for m in DEFAULT_METRICS if m in values}
+
+
+def seed(args):
+	rng = random.Random(args.seed)
+	end = datetime.now(tz=timezone.utc).replace(second=0, microsecond=0)
+	start = end - timedelta(days=args.days)
+	steps = int(args.days * 86400 // args.interval)
+	conn = _get_connection()
+	try:
+		with conn.cursor() as cur:
+			if args.schema:
+				cur.execute(schema_sql())
+				conn.commit()
+			if args.reset:
+				cur.execute("DELETE FROM organisation_master WHERE org_id LIKE 'bench-%';")
+			hashed = pbkdf2_sha256.hash(PASSWORD)
+			hierarchy = list(fleet(args.orgs, args.sites, args.plants, args.devices))
+			for org_id in sorted({h[0] for h in hierarchy}):
+				cur.execute(
+					"INSERT INTO organisation_master (org_id, org_name) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
+					(org_id, org_id),
+				)
+				cur.execute(
+					"""
+					INSERT INTO user_master (username, password, org_id, role) VALUES (%s, %s, %s, 'admin')
+					ON CONFLICT (username) DO UPDATE SET password = EXCLUDED.password;
+					""",
+					(org_id, hashed, org_id),
+				)
+			for org_id, site_id in sorted({h[:2] for h in hierarchy}):
+				cur.execute(
+					"INSERT INTO site_master (site_id, org_id, site_name) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;",
+					(site_id, org_id, site_id),
+				)
+			for site_id, plant_id in sorted({h[1:3] for h in hierarchy}):
+				cur.execute(
+					"INSERT INTO plant_master (plant_id, site_id, plant_name) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;",
+					(plant_id, site_id, plant_id),
+				)
+			for _, _, plant_id, device_id in hierarchy:
+				cur.execute(
+					"""
+					INSERT INTO device_master (device_id, plant_id, device_name, device_type)
+					VALUES (%s, %s, %s, 'energy_meter') ON CONFLICT DO NOTHING;
+					""",
+					(device_id, plant_id, device_id),
+				)
+			conn.commit()
+
+			started = time.perf_counter()
+			total = 0
+			for _, _, _, device_id in hierarchy:
+				phase = rng.random()
+				energy = rng.uniform(1000, 50000)
+				buf = io.StringIO()
+				for i in range(steps):
+					ts = start + timedelta(seconds=i * args.interval)
+					energy += rng.uniform(0, 0.5) * args.interval / 60
+					data = json.dumps(sample(rng, phase, ts.timestamp(), round(energy, 3)))
+					buf.write(f"{device_id}\t{ts.isoformat()}\t{data}\n")
+				buf.seek(0)
+				# a re-seed over existing rows would hit the primary key, so clear the window first
+				cur.execute("DELETE FROM telemetry WHERE device_id=%s AND ts >= %s;", (device_id, start))
+				cur.copy_expert("COPY telemetry (device_id, ts, data) FROM STDIN", buf)
+				conn.commit()
+				total += steps
+			elapsed = time.perf_counter() - started
+	finally:
+		conn.close()
+	print(json.dumps({
+		"devices": len(hierarchy),
+		"rows": total,
+		"from": start.isoformat(),
+		"to": end.isoformat(),
+		"seconds": round(elapsed, 2),
+	}))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--orgs", type=int, default=1)
+	parser.add_argument("--sites", type=int, default=2, help="per org")
+	parser.add_argument("--plants", type=int, default=2, help="per site")
+	parser.add_argument("--devices", type=int, default=5, help="per plant")
+	parser.add_argument("--days", type=float, default=7)
+	parser.add_argument("--interval", type=float, default=60, help="seconds between samples")
+	parser.add_argument("--seed", type=int, default=42)
+	parser.add_argument("--schema", action="store_true", help="apply sql_file.sql first (fresh database)")
+	parser.add_argument("--reset", action="store_true", help="drop existing bench-* hierarchy first")
+	seed(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+	main()
@@ -44,6 +44,31 @@ CREATE TABLE device_master (
     created_at   TIMESTAMPTZ DEFAULT now()
 );
 
+-- plant/site charts resolve their device set through these
+CREATE INDEX IF NOT EXISTS idx_device_master_plant ON device_master (plant_id);
+CREATE INDEX IF NOT EXISTS idx_plant_master_site ON plant_master (site_id);
+
+CREATE TABLE user_master (
+    username   TEXT PRIMARY KEY,
+    password   TEXT NOT NULL,      -- pbkdf2_sha256 hash
+    org_id     TEXT REFERENCES organisation_master(org_id) ON DELETE CASCADE,
+    role       TEXT DEFAULT 'operator',
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+
+-- Per-device API keys for gateways (X-Device-Key: <key_id>.<secret>);
+-- only the SHA-256 of the random secret is stored
+CREATE TABLE device_credential (
+    key_id      TEXT PRIMARY KEY,
+    device_id   TEXT NOT NULL REFERENCES device_master(device_id) ON DELETE CASCADE,
+    secret_hash TEXT NOT NULL,
+    label       TEXT,
+    created_at  TIMESTAMPTZ DEFAULT now(),
+    revoked_at  TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_device_credential_device ON device_credential (device_id);
+
 -- =====================================================
 -- UNIFIED TELEMETRY TABLE (FOR ALL DEVICES)
 -- =====================================================
@@ -77,6 +102,100 @@ ALTER TABLE telemetry
 -- Compress data older than 30 days
 SELECT add_compression_policy('telemetry', INTERVAL '30 days');
 
+-- =====================================================
+-- METRIC REGISTRY (queryable JSONB keys)
+-- =====================================================
+
+-- promoted metrics get a typed m_<name> column on telemetry, filled by the
+-- telemetry_fill_metrics trigger; reads switch to it once backfilled_at is set:
+--   python -m app.db.metric_registry promote pf_total
+--   python -m app.db.metric_registry backfill pf_total
+CREATE TABLE IF NOT EXISTS metric_registry (
+    name         TEXT PRIMARY KEY,
+    promoted     BOOLEAN NOT NULL DEFAULT false,
+    backfilled_at TIMESTAMPTZ,
+    created_at   TIMESTAMPTZ DEFAULT now()
+);
+
+INSERT INTO metric_registry (name)
+VALUES ('thd_v_r'), ('pf_total'), ('frequency'), ('energy_kwh'),
+       ('current_avg'), ('voltage_ll_avg'), ('active_power_total')
+ON CONFLICT DO NOTHING;
+
+-- =====================================================
+-- ALERTS (evaluated on ingest by app.core.alerts)
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS alert_rule (
+    rule_id     BIGSERIAL PRIMARY KEY,
+    device_id   TEXT NOT NULL REFERENCES device_master(device_id) ON DELETE CASCADE,
+    metric      TEXT NOT NULL,
+    kind        TEXT NOT NULL CHECK (kind IN ('threshold', 'rate', 'zscore')),
+    lower       DOUBLE PRECISION,          -- threshold
+    upper       DOUBLE PRECISION,          -- threshold
+    max_rate    DOUBLE PRECISION,          -- rate, units per second
+    z_limit     DOUBLE PRECISION,          -- zscore
+    alpha       DOUBLE PRECISION,          -- zscore: EW weight, NULL = cumulative
+    min_samples INTEGER NOT NULL DEFAULT 30,
+    cooldown_s  DOUBLE PRECISION NOT NULL DEFAULT 300,
+    enabled     BOOLEAN NOT NULL DEFAULT true,
+    created_at  TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_alert_rule_device ON alert_rule (device_id);
+
+-- running per-rule state, checkpointed so a restart does not re-read history
+CREATE TABLE IF NOT EXISTS alert_state (
+    rule_id    BIGINT PRIMARY KEY REFERENCES alert_rule(rule_id) ON DELETE CASCADE,
+    last_ts    BIGINT,                     -- ms
+    last_value DOUBLE PRECISION,
+    n          BIGINT NOT NULL DEFAULT 0,
+    mean       DOUBLE PRECISION NOT NULL DEFAULT 0,
+    m2         DOUBLE PRECISION NOT NULL DEFAULT 0,
+    active     BOOLEAN NOT NULL DEFAULT false,
+    last_fired BIGINT,                     -- ms
+    updated_at TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS alert_event (
+    event_id  BIGSERIAL PRIMARY KEY,
+    rule_id   BIGINT REFERENCES alert_rule(rule_id) ON DELETE CASCADE,
+    device_id TEXT NOT NULL,
+    metric    TEXT NOT NULL,
+    kind      TEXT NOT NULL,
+    status    TEXT NOT NULL,               -- 'firing' | 'resolved'
+    ts        TIMESTAMPTZ NOT NULL,
+    value     DOUBLE PRECISION,
+    score     DOUBLE PRECISION,            -- value, rate or z
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_alert_event_device ON alert_event (device_id, event_id DESC);
+
+-- =====================================================
+-- ENERGY LEDGER (hourly energy_kwh consumption, kept by app.core.energy)
+-- =====================================================
+
+-- rebuild from existing telemetry with: python -m app.db.energy backfill
+CREATE TABLE IF NOT EXISTS energy_hourly (
+    device_id   TEXT NOT NULL REFERENCES device_master(device_id) ON DELETE CASCADE,
+    bucket      TIMESTAMPTZ NOT NULL,
+    first_ts    TIMESTAMPTZ NOT NULL,
+    last_ts     TIMESTAMPTZ NOT NULL,
+    last_kwh    DOUBLE PRECISION NOT NULL,   -- register reading at last_ts
+    consumption DOUBLE PRECISION NOT NULL,   -- kWh used in the bucket, resets accounted for
+    resets      INTEGER NOT NULL DEFAULT 0,
+    samples     INTEGER NOT NULL DEFAULT 0,
+    updated_at  TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (device_id, bucket)
+);
+
+SELECT create_hypertable('energy_hourly', 'bucket', chunk_time_interval => INTERVAL '90 days', if_not_exists => TRUE);
+
+-- Rollup tiers (telemetry_1m / telemetry_1h / telemetry_1d continuous
+-- aggregates) are created by the API when ROLLUPS_ENABLED=1, or with:
+--   python -m app.db.rollups create && python -m app.db.rollups refresh
+
 -- =====================================================
 -- EXAMPLE HIERARCHY SEED DATA
 -- =====================================================